@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - Time the phases of an extraction on synthetic caches and
+print the results as JSON, so that they can be compared between versions.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import gencache
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+
+def load():
+    """Import the extractor module, which doesn't parse any arguments nor
+    configure the logging"""
+    sys.path.insert(0, SRC)
+    import extractor
+    return extractor
+
+
+def run(extractor, root, jobs):
+    """Run the phases of an extraction, return their durations"""
+    phases = {}
+    cachedir = os.path.join(root, 'Cache')
+    targetdir = os.path.join(root, 'ut2004')
+    utcachex = extractor.Extractor(cachedir, targetdir, jobs=jobs)
+    
+    start = time.perf_counter()
+    with open(os.path.join(cachedir, 'cache.ini'), 'r') as cacheini:
+        movelist, dontmovelist, retry, duplicatelist, readstate = \
+                    utcachex._preview(cacheini, (), extractor.Stats())
+    phases['preview'] = time.perf_counter() - start
+    
+    ftmp = extractor._open_tmp(cachedir)
+    start = time.perf_counter()
+    moves, errors = extractor._move_files(cachedir, movelist, dontmovelist,
+                                          jobs, extractor.Stats())
+    phases['move'] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    with ftmp:
+        for line in dontmovelist:
+            ftmp.write(line)
+    rewrite = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    utcachex._backup()
+    phases['backup'] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    extractor._replace(cachedir)
+    phases['rewrite'] = rewrite + time.perf_counter() - start
+    
+    return phases, {'moves': moves, 'errors': errors,
+                    'kept': len(dontmovelist)}
+
+
+def version():
+    with open(os.path.join(SRC, '__init__.py'), 'r') as f:
+        match = re.search(r'@version: (\S+)', f.read())
+    return match.group(1) if match else None
+
+
+def main():
+    cliparser = argparse.ArgumentParser(description='Benchmark the '
+                                        'extraction phases on synthetic '
+                                        'caches.')
+    cliparser.add_argument('-n', '--entries', type=int, nargs='+',
+                           default=[1000, 10000, 100000],
+                           help='cache.ini sizes to test (default: '
+                           '%(default)s)')
+    cliparser.add_argument('-r', '--repeat', type=int, default=3,
+                           help='runs for each size (default: %(default)s)')
+    cliparser.add_argument('-j', '--jobs', type=int, default=1,
+                           help='move threads (default: %(default)s)')
+    cliparser.add_argument('-d', '--workdir', default=None,
+                           help='where the caches are generated (default: '
+                           'a temporary directory)')
+    cliparser.add_argument('-o', '--output', default=None,
+                           help='write the results to this file instead of '
+                           'stdout')
+    cliparser.add_argument('--distribution', default='lognormal',
+                           choices=('fixed', 'uniform', 'lognormal'))
+    cliparser.add_argument('--size', type=int, default=16384)
+    cliparser.add_argument('--unknown', type=float, default=0.02)
+    cliparser.add_argument('--missing', type=float, default=0.02)
+    cliparser.add_argument('--installed', type=float, default=0.05)
+    cliparser.add_argument('--malformed', type=float, default=0.01)
+    cliparser.add_argument('--backups', type=int, default=5)
+    cliparser.add_argument('--sparse', action='store_true')
+    cliparser.add_argument('--seed', type=int, default=0)
+    args = cliparser.parse_args()
+    
+    extractor = load()
+    workdir = tempfile.mkdtemp(prefix='utcachex-bench-', dir=args.workdir)
+    results = []
+    try:
+        for entries in args.entries:
+            for repeat in range(args.repeat):
+                root = os.path.join(workdir, '{}-{}'.format(entries, repeat))
+                generated = gencache.generate(root, entries,
+                                    args.distribution, args.size,
+                                    args.unknown, args.missing,
+                                    args.installed, args.malformed,
+                                    args.backups, args.sparse, args.seed)
+                phases, counts = run(extractor, root, args.jobs)
+                shutil.rmtree(root)
+                results.append({'entries': entries, 'repeat': repeat,
+                                'generated': generated, 'counts': counts,
+                                'phases': phases})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    report = {
+        'version': version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parameters': vars(args),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
+        print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - Generate a synthetic UT2004 Cache directory, with its
+cache.ini and *.uxx files, and the corresponding target directory, to be
+used by the benchmarks.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+
+EXTENSIONS = ('.ukx', '.ut2', '.ogg', '.uax', '.usx', '.u', '.utx')
+SUBDIRS = ('Animations', 'Maps', 'Music', 'Sounds', 'StaticMeshes', 'System',
+           'Textures')
+UNKNOWN_EXTENSIONS = ('.int', '.det', '.uvx', '.zzz')
+MALFORMED_LINES = ('{guid}={name}\n',
+                   '{guid}-1={name}\n',
+                   '{lguid}-1={name}.utx\n',
+                   'Garbage line {n}\n')
+BLOCK = b'\0' * (1024 * 1024)
+
+
+def _size(rand, distribution, size):
+    if distribution == 'fixed':
+        return size
+    if distribution == 'uniform':
+        return rand.randint(0, 2 * size)
+    # Lognormal with the given median, like real package sizes
+    return int(rand.lognormvariate(math.log(max(size, 1)), 1))
+
+
+def _write(path, size, sparse):
+    with open(path, 'wb') as f:
+        if sparse:
+            f.truncate(size)
+        else:
+            while size > 0:
+                size -= f.write(BLOCK[:min(size, len(BLOCK))])
+
+
+def generate(root, entries, distribution='lognormal', size=16384,
+             unknown=0.02, missing=0.02, installed=0.05, malformed=0.01,
+             backups=5, sparse=False, seed=0):
+    """Generate root/Cache and root/ut2004, return the generated counts"""
+    rand = random.Random(seed)
+    cachedir = os.path.join(root, 'Cache')
+    targetdir = os.path.join(root, 'ut2004')
+    os.makedirs(cachedir)
+    for subdir in SUBDIRS:
+        os.makedirs(os.path.join(targetdir, subdir))
+    
+    counts = dict.fromkeys(('movable', 'unknown', 'missing', 'installed',
+                            'malformed'), 0)
+    with open(os.path.join(cachedir, 'cache.ini'), 'w') as cacheini:
+        cacheini.write('[Cache]\n')
+        for n in range(entries):
+            guid = '{:032X}'.format(rand.getrandbits(128))
+            name = 'Pkg{:07d}'.format(n)
+            draw = rand.random()
+            
+            if draw < malformed:
+                cacheini.write(rand.choice(MALFORMED_LINES).format(guid=guid,
+                                        lguid=guid.lower(), name=name, n=n))
+                counts['malformed'] += 1
+                continue
+            draw -= malformed
+            
+            if draw < unknown:
+                ext = rand.choice(UNKNOWN_EXTENSIONS)
+                kind = 'unknown'
+            else:
+                index = rand.randrange(len(EXTENSIONS))
+                ext = EXTENSIONS[index]
+                draw -= unknown
+                if draw < missing:
+                    kind = 'missing'
+                elif draw - missing < installed:
+                    kind = 'installed'
+                    _write(os.path.join(targetdir, SUBDIRS[index], name + ext),
+                           1, sparse)
+                else:
+                    kind = 'movable'
+            
+            cacheini.write('{}-1={}{}\n'.format(guid, name, ext))
+            if kind != 'missing':
+                _write(os.path.join(cachedir, guid + '-1.uxx'),
+                       _size(rand, distribution, size), sparse)
+            counts[kind] += 1
+    
+    # Old backups for the rotation
+    for n in range(backups):
+        _write(os.path.join(cachedir,
+                            'cache.ini.bak.2000010100{:04d}'.format(n)), 1,
+               sparse)
+    
+    return counts
+
+
+def main():
+    cliparser = argparse.ArgumentParser(description='Generate a synthetic '
+                                        'UT2004 Cache directory.')
+    cliparser.add_argument('root', help='the directory where the Cache and '
+                           'ut2004 directories are created')
+    cliparser.add_argument('-n', '--entries', type=int, default=1000,
+                           help='number of cache.ini entries (default: '
+                           '%(default)s)')
+    cliparser.add_argument('--distribution', default='lognormal',
+                           choices=('fixed', 'uniform', 'lognormal'),
+                           help='file size distribution (default: '
+                           '%(default)s)')
+    cliparser.add_argument('--size', type=int, default=16384,
+                           help='median file size in bytes (default: '
+                           '%(default)s)')
+    cliparser.add_argument('--unknown', type=float, default=0.02,
+                           help='ratio of unknown extensions (default: '
+                           '%(default)s)')
+    cliparser.add_argument('--missing', type=float, default=0.02,
+                           help='ratio of missing cache files (default: '
+                           '%(default)s)')
+    cliparser.add_argument('--installed', type=float, default=0.05,
+                           help='ratio of already installed files (default: '
+                           '%(default)s)')
+    cliparser.add_argument('--malformed', type=float, default=0.01,
+                           help='ratio of malformed lines (default: '
+                           '%(default)s)')
+    cliparser.add_argument('--backups', type=int, default=5,
+                           help='number of old cache.ini backups (default: '
+                           '%(default)s)')
+    cliparser.add_argument('--sparse', action='store_true',
+                           help='create sparse files')
+    cliparser.add_argument('--seed', type=int, default=0,
+                           help='random seed (default: %(default)s)')
+    args = cliparser.parse_args()
+    counts = generate(args.root, args.entries, args.distribution, args.size,
+                      args.unknown, args.missing, args.installed,
+                      args.malformed, args.backups, args.sparse, args.seed)
+    print(json.dumps(counts, sort_keys=True))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - Run the benchmark on a small synthetic cache, so that it
+keeps working as the extractor changes: python -m pytest bench
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import os
+
+import benchmark
+import gencache
+
+
+def test_run(tmp_path):
+    extractor = benchmark.load()
+    root = os.path.join(str(tmp_path), 'cache')
+    generated = gencache.generate(root, 200, sparse=True, seed=1)
+    phases, counts = benchmark.run(extractor, root, 2)
+    assert set(phases) == {'preview', 'move', 'backup', 'rewrite'}
+    assert counts['errors'] == 0
+    assert counts['moves'] == generated['movable']
+    assert counts['kept'] > 0
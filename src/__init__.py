@@ -27,23 +27,25 @@ subdirectories, renaming them with their real name.
 """
 
 import sys as _sys
-import shutil as _shutil
 import os as _os
-import re as _re
 import time as _time
+import json
+import sqlite3
+import contextlib
+import concurrent.futures as _futures
 
 import consolecolors
 import inputtemplate
 import plural
 
-from logger import logger
-from cliargparse import config
-
-backupsN = config.get_int('backupsN')
-cachedir = config.get('cachedir')
-targetdir = config.get('targetdir')
-
-inputtemplate.automode = config.get_bool('autoinput')
+from logger import logger, setup as setup_logging, \
+                   shutdown as shutdown_logging
+from cliargparse import parse
+from extractor import Extractor
+from output import WRITERS, TextWriter, open_stdout
+from catalog import Catalog
+from progress import Progress
+import metrics
 
 
 class CliCode():
@@ -56,235 +58,358 @@ class CliCode():
 clicode = CliCode()
 
 
-class CacheFile:
-    """A file to be moved from the cache"""
-    def __init__(self, reline):
-        # Retrieve file name strings
-        self.cachename = ''.join((reline.group(1), '.uxx'))
-        self.realname = reline.group(2)
-        self.realext = reline.group(3)
-        self.realpath = ''
-    
-    def setpath(self):
-        # Set the path based on file extension, or don't move the file
-        paths = {
-                '.ukx': 'Animations/',
-                '.ut2': 'Maps/',
-                '.ogg': 'Music/',
-                '.uax': 'Sounds/',
-                '.usx': 'StaticMeshes/',
-                '.u': 'System/',
-                '.utx': 'Textures/'
-                }
-        if self.realext in paths:
-            self.realpath = paths[self.realext]
+class CliExtractor(Extractor):
+    """An Extractor that writes the preview in the output format and asks
+    for confirmation"""
+    errorcode = clicode.error
+    resetcode = clicode.reset
+
+    def __init__(self, cachedir, targetdir, output='text', progress=False,
+                 **options):
+        super().__init__(cachedir, targetdir, **options)
+        self.output = output
+        self.stream = None
+        self.writer = None
+        # Show the progress of the moves on stderr
+        self.showprogress = progress
+        self.measure = progress
+        self.progress = None
+
+    @contextlib.contextmanager
+    def _writing(self):
+        # Write the entries shown in the block in the output format
+        if self.stream is None:
+            self.stream = open_stdout()
+        _sys.stdout.flush()
+        if self.output == 'text':
+            self.writer = TextWriter(self.stream, clicode.head1,
+                                     clicode.arrow, clicode.reset)
+        else:
+            self.writer = WRITERS[self.output](self.stream)
+        try:
+            yield
+        finally:
+            self._close_writer()
+            if self.progress is not None:
+                self.progress.close()
+                self.progress = None
+
+    def run(self, known=()):
+        with self._writing():
+            return super().run(known)
+
+    def ingest(self, sourcedir):
+        with self._writing():
+            return super().ingest(sourcedir)
+
+    def _close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def show(self, cachename, realname, target, decision, reason):
+        self.writer.write({'cache': cachename, 'real': realname,
+                           'destination': target, 'decision': decision,
+                           'reason': reason})
+
+    def planned(self, files, size):
+        if self.showprogress:
+            if self.progress is None:
+                self.progress = Progress(_sys.stderr)
+            self.progress.plan(files, size)
+
+    def progressed(self, size):
+        if self.progress is not None:
+            self.progress.advance(size)
+
+    def confirm(self, moves, duplicates):
+        # The preview must be complete before the question
+        self._close_writer()
+        if duplicates > 0:
+            prompt = ('{}Do you want to move the file{P0s} and remove the '
+                      'duplicate{P1s}? [y|n]{reset} ')
         else:
-            raise CustomError('{} extension not recognized'.format(self.realext
-                                                                   ))
+            prompt = '{}Do you want to move the file{P0s}? [y|n]{reset} '
+        question = inputtemplate.InputTemplate(
+            prompt=prompt.format(clicode.question, reset=clicode.reset,
+                                 **plural.set((moves, duplicates))),
+            inputs={
+                'yes': ('y', 'yes'),
+                'no': ('n', 'no')
+            },
+            auto='yes',
+            wrong='Invalid input, please try again'
+        )
+        logger.debug('Do you want to move the file(s)? {}'.format(
+                                                            question.string))
+        return question.group == 'yes'
+
+
+def _options(config):
+    # The Extractor arguments that come from the configuration
+    return {
+        'backupsN': config.get_int('backupsN'),
+        'jobs': config.get_int('jobs'),
+        'dedup': config.get_bool('dedup'),
+        'incremental': config.get_bool('incremental'),
+        'syncevery': config.get_int('syncevery'),
+        'redirectdir': config.get('redirectdir') or None,
+        'exportall': config.get_bool('exportall'),
+        'processes': config.get_int('processes'),
+        'verify': config.get_bool('verify'),
+        'catalog': config.get('catalog') or None,
+        'installmode': config.get('installmode'),
+        'streaming': config.get_bool('streaming'),
+        'order': config.get('order'),
+        'bytespersec': config.get_int('bytespersec'),
+        'filespersec': float(config.get('filespersec')),
+        'idleio': config.get_bool('idleio'),
+        'neededby': [name for name in config.get('neededby').split(',')
+                     if name],
+        'gamedir': config.get('gamedir') or None,
+    }
+
 
+def _report(result, statsformat):
+    if statsformat:
+        for line in result.stats.format(statsformat):
+            logger.info(line)
 
-class CustomError(Exception):
-    pass
 
+def _sample(extractor, result, start):
+    # The metrics of a run for the textfile exporter
+    return metrics.sample(extractor.cachedir, round(start, 3),
+                          round(_time.time() - start, 3), result.status,
+                          result.moves, result.removals,
+                          result.stats.counters.get('bytes_moved', 0),
+                          result.errors, extractor.backlog())
 
-def main():
+
+def _write_metrics(metricsfile, samples):
     try:
-        _os.chdir(cachedir)
+        metrics.write(metricsfile, samples)
     except EnvironmentError as e:
-        logger.critical('Cannot enter {} ({})'.format(e.filename, e.strerror))
-        _sys.exit(1)
+        logger.error('Cannot write the metrics to {} ({})'.format(metricsfile,
+                                                              e.strerror))
+
+
+def _run_once(extractor, known, statsformat, metricsfile):
+    start = _time.time()
+    result = extractor.run(known)
+    _report(result, statsformat)
+    if metricsfile:
+        _write_metrics(metricsfile, [_sample(extractor, result, start)])
+    return result
 
-    if not _os.path.isdir(targetdir):
-        logger.critical('Cannot find {} (check targetdir variable)'.format(
-                                                                    targetdir))
-        _sys.exit(1)
 
+def list_backups(extractor):
     try:
-        cacheini = open('cache.ini', 'r')
+        ids = extractor.backups()
+    except (EnvironmentError, ValueError) as e:
+        logger.critical('Cannot read the backups ({})'.format(e))
+        return 1
+    if not ids:
+        logger.info('There are no backups')
+    for gid in ids:
+        print(gid)
+    return 0
+
+
+def watch(extractor, debounce, statsformat, metricsfile=''):
+    """Keep extracting the files that appear in the cache"""
+    # Imported here, as it is only needed in watch mode
+    from watcher import Watcher
+    
+    result = _run_once(extractor, (), statsformat, metricsfile)
+    if result.status != 0:
+        return result.status
+    known = set(result.kept)
+    
+    watcher = Watcher(extractor.cachedir)
+    logger.info('Watching {} for changes ({})'.format(extractor.cachedir,
+                                                      watcher.backend))
+    try:
+        for names in watcher.changes(debounce):
+            logger.debug('Changes detected: {}'.format(', '.join(
+                                                            sorted(names))))
+            # The lines of the files that have just appeared must be checked
+            # again
+            appeared = set(name for name in names if name.endswith('.uxx'))
+            known = set(line for line in known
+                                        if line.split('=', 1)[0] + '.uxx'
+                                                        not in appeared)
+            result = _run_once(extractor, known, statsformat, metricsfile)
+            watcher.written('cache.ini')
+            if result.status == 0:
+                known = set(result.kept)
+    except KeyboardInterrupt:
+        logger.info('Watch mode stopped')
+    finally:
+        watcher.close()
+    return 0
+
+
+def _batch_run(cachedir, targetdir, options, output, statsformat,
+               metricsfile):
+    # Executed in the worker processes: return only what the summary and the
+    # metrics need
+    start = _time.time()
+    extractor = CliExtractor(cachedir, targetdir, output, **options)
+    result = extractor.run()
+    _report(result, statsformat)
+    sample = _sample(extractor, result, start) if metricsfile else None
+    return result.status, result.moves, result.removals, result.errors, \
+           sample
+
+
+def batch(manifest, processes, options, output, statsformat, metricsfile=''):
+    """Process the installs listed in manifest in a process pool"""
+    from batch import ManifestError, read_manifest
+    
+    try:
+        pairs = read_manifest(manifest)
     except EnvironmentError as e:
-        logger.critical('Cannot open {} ({})'.format(e.filename, e.strerror))
-        _sys.exit(1)
-    else:
-        with cacheini:
-            print('{}=== PREVIEW ==={reset}'.format(clicode.head1,
-                                                          reset=clicode.reset))
-            
-            movelist, dontmovelist = [], []
-            
-            for line in cacheini:
-                dontmove = False
-                
-                reline = _re.match(
-                          '^([0-9A-Z]{32}-[0-9]+)(?:\=)(.+)(\.\w{1,3})(?:\n)$',
-                          line)
-                if reline:
-                    utfile = CacheFile(reline)
-                    
-                    try:
-                        utfile.setpath()
-                    except CustomError as e:
-                        logger.warning('{} extension has not been '
-                                       'recognized, {} will be left in the '
-                                       'cache'.format(utfile.realext,
-                                                      utfile.cachename))
-                        dontmove = True
-                    else:
-                        if not _os.path.isfile(utfile.cachename):
-                            logger.warning('{} does not exist in the cache, '
-                                         'its line will be left in cache.ini, '
-                                         'but you should probably delete it '
-                                         'manually'.format(utfile.cachename))
-                            dontmove = True
-                        
-                        elif _os.path.isfile(_os.path.join(targetdir,
-                                                           utfile.realpath,
-                                                           utfile.realname +
-                                                           utfile.realext)):
-                            logger.warning('{} already exists, {} will be '
-                                           'left in the cache'.format(
-                                                       _os.path.join(targetdir,
-                                                              utfile.realpath,
-                                                              utfile.realname +
-                                                              utfile.realext),
-                                                       utfile.cachename))
-                            dontmove = True
-                
-                else:
-                    if not _re.match('^(\[Cache\]|\n)', line):
-                        line = line.rstrip()
-                        logger.warning('"{}" cannot be recognized, it will be '
-                                              'left in cache.ini'.format(line))
-                    dontmove = True
-                
-                if dontmove:
-                    if not _re.match('^\n', line):
-                        dontmovelist.append(line)
-                else:
-                    movelist.append((utfile.cachename,
-                                     _os.path.join(targetdir, utfile.realpath),
-                                     _os.path.join(targetdir, utfile.realpath,
-                                      utfile.realname + utfile.realext), line))
-                    print(utfile.cachename, _os.path.join(targetdir,
-                            utfile.realpath, utfile.realname + utfile.realext),
-                          sep=' {}-->{reset} '.format(clicode.arrow,
-                                                      reset=clicode.reset))
-
-    if len(movelist) == 0:
-        logger.info('There are no files to move')
-        _sys.exit()  # If writing a message here, the return status would be 1
-
-    question = inputtemplate.InputTemplate(
-        prompt='{}Do you want to move the file{P0s}? '
-                          '[y|n]{reset} '.format(clicode.question,
-                          reset=clicode.reset, **plural.set((len(movelist),))),
-        inputs={
-            'yes': ('y', 'yes'),
-            'no': ('n', 'no')
-        },
-        auto='yes',
-        wrong='Invalid input, please try again'
-    )
-    logger.debug('Do you want to move the file(s)? {}'.format(question.string))
-    if question.group == 'no':
-        logger.info('No changes were made')
-        _sys.exit()  # If writing a message here, the return status would be 1
-    elif question.group == 'yes':
-        try:
-            if _os.path.isfile('cache.ini.tmp'):
-                logger.warning('Overwriting existing cache.ini.tmp')
-                open('cache.ini.tmp', 'w').close()
-            ftmp = open('cache.ini.tmp', 'a')
-        except EnvironmentError as e:
-            logger.critical('Cannot open {} ({})'.format(e.filename,
-                                                         e.strerror))
-            _sys.exit(1)
-        else:
-            with ftmp:
-                moves = 0
-                errors = 0
-                
-                for cache_file in movelist:
-                    try:
-                        if not _os.path.isdir(cache_file[1]):
-                            _os.mkdir(cache_file[1])
-                            _os.chmod(cache_file[1], 0o755)
-                            logger.debug('{} directory created'.format(
-                                                                cache_file[1]))
-                    except EnvironmentError as e:
-                        logger.error('Cannot create {} directory '
-                                     '({})'.format(e.filename, e.strerror))
-                        dontmovelist.append(cache_file[3])
-                        errors += 1
-                    else:
-                        try:
-                            _shutil.move(cache_file[0], cache_file[2])
-                        except EnvironmentError as e:
-                            logger.error('Cannot move {} to {} ({})'.format(
-                                     cache_file[0], cache_file[2], e.strerror))
-                            dontmovelist.append(cache_file[3])
-                            errors += 1
-                        else:
-                            logger.debug('{} moved to {}'.format(cache_file[0],
-                                                                cache_file[2]))
-                            moves += 1
-                
-                for line in dontmovelist:
-                    ftmp.write(line)
-        
-        filesmoved = '{} file{P0s} moved'.format(moves, **plural.set((moves,)))
-        if errors > 0:
-            filesmoved += ' ({} {}ERROR{reset}{P0s} reported)'.format(errors,
-                                            clicode.error, reset=clicode.reset,
-                                            **plural.set((errors,)))
-        logger.info(filesmoved)
-        
-        if moves > 0:
-            bkpext = _time.strftime('%Y%m%d%H%M%S')
-            while _os.path.isfile('cache.ini.bak.' + bkpext):
-                bkpext = repr(int(bkpext) + 1)
-            
+        logger.critical('Cannot read {} ({})'.format(e.filename, e.strerror))
+        return 1
+    except ManifestError as e:
+        logger.critical(e)
+        return 1
+    
+    with _futures.ProcessPoolExecutor(max_workers=processes or None) as \
+                                                                    executor:
+        futures = [executor.submit(_batch_run, cachedir, targetdir, options,
+                                   output, statsformat, metricsfile)
+                                            for cachedir, targetdir in pairs]
+        outcomes = []
+        for (cachedir, targetdir), future in zip(pairs, futures):
             try:
-                _shutil.copy('cache.ini', 'cache.ini.bak.' + bkpext)
-            except EnvironmentError:
-                logger.critical('Couldn\'t create a backup for cache.ini, '
-                                'to complete the operations you have to '
-                                'overwrite it manually with cache.ini.tmp '
-                                '(which is the updated version)')
-                raise
-            else:
-                logger.info('cache.ini backup successfully created')
-                
-                cachelist = _os.listdir('.')
-                datelist = []
-                for f in cachelist:
-                    redate = _re.match('^(?:cache\.ini\.bak\.)([0-9]{14})$', f)
-                    if redate:
-                        datelist.append(redate.group(1))
-                datelist.sort(reverse=True)
-                if backupsN >= 0:
-                    for d in datelist[backupsN:]:
-                        try:
-                            _os.remove('cache.ini.bak.' + d)
-                        except EnvironmentError as e:
-                            logger.error('Couldn\'t delete obsolete '
-                                         'backup: {} ({})'.format(e.filename,
-                                                                  e.strerror))
-
-                try:
-                    _shutil.move('cache.ini.tmp', 'cache.ini')
-                except EnvironmentError:
-                    logger.critical('Couldn\' t overwrite cache.ini (the '
-                                    'old version) with cache.ini.tmp (the '
-                                    'updated version), please do it manually')
-                    raise
-                else:
-                    logger.info('cache.ini correctly updated')
+                outcomes.append(future.result())
+            except Exception as e:
+                logger.error('{}: the run failed ({})'.format(cachedir, e))
+                outcomes.append((1, 0, 0, 1, metrics.sample(cachedir, None,
+                                        None, 1, 0, 0, 0, 1, None)))
+    
+    logger.info('=== SUMMARY ===')
+    failures = 0
+    totalmoves = 0
+    for (cachedir, targetdir), (status, moves, removals, errors,
+                                sample) in zip(pairs, outcomes):
+        message = '{}: {} file{P0s} moved, {} duplicate{P1s} removed, ' \
+                  '{} error{P2s}, exit status {}'.format(cachedir, moves,
+                        removals, errors, status,
+                        **plural.set((moves, removals, errors)))
+        if status != 0:
+            failures += 1
+            logger.error(message)
         else:
+            logger.info(message)
+        totalmoves += moves
+    logger.info('{} install{P0s} processed, {} failed, {} file{P1s} '
+                'moved'.format(len(pairs), failures, totalmoves,
+                               **plural.set((len(pairs), totalmoves))))
+    if metricsfile:
+        _write_metrics(metricsfile, [outcome[4] for outcome in outcomes])
+    return 1 if failures else 0
+
+
+def query(catalogfile, pattern, guid, output):
+    """Print the installations recorded in the catalog"""
+    if not catalogfile:
+        logger.critical('No catalog has been set (check catalog variable)')
+        return 1
+    if not _os.path.isfile(catalogfile):
+        logger.critical('Cannot find {} (check catalog '
+                        'variable)'.format(catalogfile))
+        return 1
+    try:
+        catalog = Catalog(catalogfile)
+        try:
+            records = list(catalog.query(pattern, guid))
+        finally:
+            catalog.close()
+    except sqlite3.Error as e:
+        logger.critical('Cannot read the catalog {} ({})'.format(catalogfile,
+                                                                 e))
+        return 1
+    
+    stream = open_stdout()
+    if output == 'json':
+        json.dump(records, stream)
+        stream.write('\n')
+    else:
+        for record in records:
+            if output == 'ndjson':
+                stream.write(json.dumps(record))
+            else:
+                stream.write('\t'.join((_time.strftime('%Y-%m-%d %H:%M:%S',
+                                        _time.localtime(record['time'])),
+                                        record['guid'],
+                                        record['destination'],
+                                        str(record['size']),
+                                        record['cachedir'])))
+            stream.write('\n')
+    stream.flush()
+    return 0
+
+
+def run(config):
+    if config.get('command') == 'query':
+        return query(config.get('catalog'), config.get('pattern'),
+                     config.get('guid'), config.get('output'))
+    options = _options(config)
+    statsformat = config.get('stats')
+    metricsfile = config.get('metrics')
+    if config.get('batch'):
+        return batch(config.get('batch'), config.get_int('processes'),
+                     options, config.get('output'), statsformat, metricsfile)
+    extractor = CliExtractor(config.get('cachedir'), config.get('targetdir'),
+                             config.get('output'),
+                             config.get_bool('progress'), **options)
+    if config.get('command') == 'gc':
+        result = extractor.collect(int(config.get('quota'))
+                                   if config.get('quota') else None,
+                                   config.get_bool('dryrun'))
+        _report(result, statsformat)
+        return result.status
+    if config.get('command') == 'ingest':
+        result = extractor.ingest(config.get('sourcedir'))
+        _report(result, statsformat)
+        return result.status
+    if config.get_bool('listbackups'):
+        return list_backups(extractor)
+    if config.get('restorebackup'):
+        return extractor.restore_backup(config.get('restorebackup'))
+    if config.get_bool('watch'):
+        return watch(extractor, float(config.get('debounce')), statsformat,
+                     metricsfile)
+    return _run_once(extractor, (), statsformat, metricsfile).status
+
+
+def main(argv=None):
+    config = parse(argv)
+    setup_logging(config)
+    # Nobody can answer the questions in watch and batch modes
+    inputtemplate.automode = (config.get_bool('autoinput') or
+                              config.get_bool('watch') or
+                              bool(config.get('batch')))
+    
+    profile = config.get('profile')
+    try:
+        if profile:
+            import cProfile
+            profiler = cProfile.Profile()
             try:
-                _os.remove('cache.ini.tmp')
-            except EnvironmentError as e:
-                logger.error('Couldn\'t delete {} ({})'.format(e.filename,
-                                                               e.strerror))
+                status = profiler.runcall(run, config)
+            finally:
+                profiler.dump_stats(profile)
+                logger.info('Profile saved to {}'.format(profile))
+        else:
+            status = run(config)
+    finally:
+        # Write the messages still queued for the log file before exiting
+        shutdown_logging()
+    # If writing a message in sys.exit, the return status would be 1
+    _sys.exit(status)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,175 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import bisect
+import gzip
+import json
+import os
+import re
+import time
+
+
+def diff(old, new):
+    """Return the operations that turn the list of lines old into new
+
+    Every operation is either a [start, end] slice of old to be copied or a
+    new line to be inserted; the lines are matched greedily in order, which
+    is linear for the removals and appends that cache.ini goes through.
+    """
+    positions = {}
+    for n, line in enumerate(old):
+        positions.setdefault(line, []).append(n)
+    ops = []
+    nextold = 0
+    for line in new:
+        indices = positions.get(line)
+        if indices:
+            k = bisect.bisect_left(indices, nextold)
+            if k < len(indices):
+                n = indices[k]
+                if ops and isinstance(ops[-1], list) and ops[-1][1] == n:
+                    ops[-1][1] = n + 1
+                else:
+                    ops.append([n, n + 1])
+                nextold = n + 1
+                continue
+        ops.append(line)
+    return ops
+
+
+def patch(old, ops):
+    new = []
+    for op in ops:
+        if isinstance(op, list):
+            new.extend(old[op[0]:op[1]])
+        else:
+            new.append(op)
+    return new
+
+
+def legacy(dirname):
+    """Yield the path and the timestamp of the cache.ini.bak.<timestamp>
+    files of older versions in dirname, oldest first"""
+    for name in sorted(os.listdir(dirname)):
+        match = re.match(r'^cache\.ini\.bak\.([0-9]{14})$', name)
+        if match:
+            yield os.path.join(dirname, name), match.group(1)
+
+
+class BackupStore:
+    """Generations of cache.ini backups
+
+    The oldest kept generation is stored compressed in full, every
+    following one as a compressed line-level delta from its predecessor.
+    """
+    def __init__(self, dirname):
+        self.dirname = dirname
+        try:
+            with open(self._path('index.json'), 'r') as f:
+                self.generations = json.load(f)
+        except FileNotFoundError:
+            self.generations = []
+
+    def ids(self):
+        return [generation['id'] for generation in self.generations]
+
+    def add(self, lines, gid=None):
+        """Store lines as a new generation, return its id
+
+        The id is the timestamp gid, by default the current time, made
+        later than the one of the last generation if needed.
+        """
+        if gid is None:
+            gid = time.strftime('%Y%m%d%H%M%S')
+        if self.generations:
+            while gid <= self.generations[-1]['id']:
+                gid = repr(int(gid) + 1)
+            data = diff(self.restore(self.generations[-1]['id']), lines)
+            name = 'delta.{}.gz'.format(gid)
+        else:
+            os.makedirs(self.dirname, exist_ok=True)
+            data = lines
+            name = 'base.{}.gz'.format(gid)
+        self._write(name, data)
+        self.generations.append({'id': gid, 'file': name})
+        self._save_index()
+        return gid
+
+    def restore(self, gid):
+        """Return the lines of the generation gid"""
+        lines = None
+        for generation in self.generations:
+            data = self._read(generation['file'])
+            lines = data if lines is None else patch(lines, data)
+            if generation['id'] == gid:
+                return lines
+        raise KeyError(gid)
+
+    def prune(self, keep):
+        """Keep only the latest keep generations"""
+        if len(self.generations) <= keep:
+            return
+        if keep <= 0:
+            obsolete = self.generations
+            self.generations = []
+        else:
+            first = self.generations[-keep]
+            name = 'base.{}.gz'.format(first['id'])
+            self._write(name, self.restore(first['id']))
+            obsolete = self.generations[:-keep] + [dict(first)]
+            first['file'] = name
+            self.generations = self.generations[-keep:]
+        self._save_index()
+        for generation in obsolete:
+            os.remove(self._path(generation['file']))
+
+    def migrate(self, dirname):
+        """Import the cache.ini.bak.<timestamp> files of older versions,
+        oldest first, keeping their timestamps as ids"""
+        for path, timestamp in legacy(dirname):
+            with open(path, 'r') as f:
+                self.add(f.readlines(), timestamp)
+            os.remove(path)
+
+    def _path(self, name):
+        return os.path.join(self.dirname, name)
+
+    def _read(self, name):
+        with gzip.open(self._path(name), 'rt') as f:
+            return json.load(f)
+
+    def _write(self, name, data):
+        tmp = self._path(name + '.tmp')
+        with gzip.open(tmp, 'wt') as f:
+            json.dump(data, f)
+        os.replace(tmp, self._path(name))
+
+    def _save_index(self):
+        tmp = self._path('index.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.generations, f)
+        os.replace(tmp, self._path('index.json'))
@@ -0,0 +1,57 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import os
+import shlex
+
+
+class ManifestError(Exception):
+    pass
+
+
+def read_manifest(filename):
+    """Return the list of the (cachedir, targetdir) pairs in a manifest
+
+    Every line of the manifest holds a cache folder and the corresponding
+    target folder, separated by whitespace and quoted if needed; empty
+    lines and lines starting with # are ignored.
+    """
+    pairs = []
+    with open(filename, 'r') as manifest:
+        for n, line in enumerate(manifest, 1):
+            try:
+                fields = shlex.split(line, comments=True)
+            except ValueError as e:
+                raise ManifestError('{} line {}: {}'.format(filename, n, e))
+            if not fields:
+                continue
+            if len(fields) != 2:
+                raise ManifestError('{} line {}: expected a cache and a '
+                                    'target folder'.format(filename, n))
+            pairs.append(tuple(os.path.expanduser(field)
+                                                    for field in fields))
+    return pairs
@@ -0,0 +1,99 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import os
+import re
+
+# The beginning of the cache.ini lines that refer to a cache file
+ENTRY = re.compile(r'([0-9A-Z]{32}-[0-9]+)=')
+
+
+class Plan:
+    """What can be deleted from a cache
+
+    orphans are the cache files that no cache.ini line refers to, deadlines
+    the cache.ini lines whose file doesn't exist, evicted the least recently
+    used files (with their lines) that must go to respect the quota; kept
+    are the cache.ini lines to be left.
+    """
+    def __init__(self):
+        self.orphans = []
+        self.deadlines = []
+        self.evicted = []
+        self.kept = []
+        self.sizes = {}
+        # The size of the cache files that are left
+        self.used = 0
+
+    def reclaimed(self):
+        """Return the number of bytes freed by deleting the files"""
+        return sum(self.sizes[name] for name in self.orphans + self.evicted)
+
+
+def plan(cachedir, lines, quota=None):
+    """Return the Plan for the cache in cachedir, whose cache.ini has lines
+
+    The cache folder is scanned only once. If quota is not None, the least
+    recently used files, by access or modification time, are evicted until
+    the files left take at most quota bytes.
+    """
+    result = Plan()
+    lastuse = {}
+    with os.scandir(cachedir) as entries:
+        for entry in entries:
+            if entry.name.endswith('.uxx') and entry.is_file(
+                                                    follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                result.sizes[entry.name] = st.st_size
+                lastuse[entry.name] = max(st.st_atime, st.st_mtime)
+    
+    referenced = {}
+    for line in lines:
+        match = ENTRY.match(line)
+        if match:
+            name = match.group(1) + '.uxx'
+            if name not in result.sizes:
+                result.deadlines.append(line)
+                continue
+            referenced[name] = line
+        result.kept.append(line)
+    
+    result.orphans = sorted(name for name in result.sizes
+                                                if name not in referenced)
+    result.used = sum(result.sizes[name] for name in referenced)
+    
+    if quota is not None and result.used > quota:
+        for name in sorted(referenced, key=lambda name: (lastuse[name],
+                                                         name)):
+            if result.used <= quota:
+                break
+            result.evicted.append(name)
+            result.used -= result.sizes[name]
+        evicted = set(referenced[name] for name in result.evicted)
+        result.kept = [line for line in result.kept if line not in evicted]
+    
+    return result
@@ -0,0 +1,120 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import os
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS installs (
+    guid TEXT NOT NULL,
+    realname TEXT NOT NULL,
+    ext TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    time REAL NOT NULL,
+    cachedir TEXT NOT NULL,
+    inode INTEGER,
+    mtime INTEGER
+);
+CREATE INDEX IF NOT EXISTS installs_destination ON installs (destination);
+CREATE INDEX IF NOT EXISTS installs_guid ON installs (guid);
+"""
+COLUMNS = ('guid', 'realname', 'ext', 'destination', 'size', 'time',
+           'cachedir', 'inode', 'mtime')
+# The columns added after the first version, with their types
+ADDED = (('inode', 'INTEGER'), ('mtime', 'INTEGER'))
+
+
+class Catalog:
+    """The provenance of the installed files, in an SQLite database
+
+    Destinations are stored as absolute paths, with the inode and the
+    modification time in nanoseconds of the installed file; a file installed
+    more than once has a row for every installation.
+    """
+    def __init__(self, filename):
+        self.connection = sqlite3.connect(filename, timeout=30)
+        try:
+            # Concurrent runs, e.g. in batch mode, can read while one writes
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.executescript(SCHEMA)
+            existing = set(row[1] for row in self.connection.execute(
+                                                'PRAGMA table_info(installs)'))
+            for column, kind in ADDED:
+                if column not in existing:
+                    # Left NULL in the rows of the older installations
+                    self.connection.execute('ALTER TABLE installs ADD '
+                                            'COLUMN {} {}'.format(column,
+                                                                  kind))
+        except sqlite3.Error:
+            self.connection.close()
+            raise
+
+    def lookup(self, destination):
+        """Return the latest installation of destination as a dict, or None
+        if it is not in the catalog"""
+        row = self.connection.execute(
+                    'SELECT {} FROM installs WHERE destination = ? '
+                    'ORDER BY time DESC LIMIT 1'.format(', '.join(COLUMNS)),
+                    (os.path.abspath(destination),)).fetchone()
+        return dict(zip(COLUMNS, row)) if row is not None else None
+
+    def record(self, installs, time, cachedir):
+        """Add the (guid, realname, ext, destination, size, inode, mtime)
+        installations, all in a single transaction"""
+        cachedir = os.path.abspath(cachedir)
+        with self.connection:
+            self.connection.executemany(
+                    'INSERT INTO installs ({}) VALUES ({})'.format(
+                                        ', '.join(COLUMNS),
+                                        ', '.join('?' * len(COLUMNS))),
+                    ((guid, realname, ext, os.path.abspath(destination), size,
+                      time, cachedir, inode, mtime)
+                     for guid, realname, ext, destination, size, inode, mtime
+                                                                in installs))
+
+    def query(self, pattern=None, guid=None):
+        """Yield the installations whose destination ends with the glob
+        pattern and whose GUID is guid, as dicts, oldest first"""
+        conditions = []
+        parameters = []
+        if pattern:
+            conditions.append('destination GLOB ?')
+            parameters.append('*' + pattern)
+        if guid:
+            conditions.append('guid = ?')
+            parameters.append(guid.upper())
+        sql = 'SELECT {} FROM installs'.format(', '.join(COLUMNS))
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        for row in self.connection.execute(sql + ' ORDER BY time, rowid',
+                                           parameters):
+            yield dict(zip(COLUMNS, row))
+
+    def close(self):
+        self.connection.close()
@@ -27,6 +27,7 @@ subdirectories, renaming them with their real name.
 
 import argparse
 import os
+import re
 import sys
 
 import configfile
@@ -43,18 +44,51 @@ conditions of the GNU General Public License version 3 or later.
 See <http://gnu.org/licenses/gpl.html> for details.''')
         sys.exit()
 
-config = configfile.ConfigFile(
-    {
-        # Any change to the default values here must be reflected in the help
-        # descriptions of the add_argument's below
-        'backupsN': '5',
-        'cachedir': os.getenv('HOME') + '/.ut2004/Cache/',
-        'configfile': 'utcachex.conf',
-        'loglevel': '20',
-        'logfile': 'utcachex.log',
-        'targetdir': os.getenv('HOME') + '/.ut2004/',
-    }
-)
+def size(value):
+    """Convert a size like 500M or 2G (powers of 1024) to bytes"""
+    match = re.match(r'^\s*(\d+)\s*([KMGT]?)(?:i?B)?\s*$', value, re.I)
+    if not match:
+        raise argparse.ArgumentTypeError('invalid size: {}'.format(value))
+    return int(match.group(1)) * 1024 ** ' KMGT'.index(
+                                            match.group(2).upper() or ' ')
+
+DEFAULTS = {
+    # Any change to the default values here must be reflected in the help
+    # descriptions of the add_argument's below
+    'backupsN': '5',
+    'batch': '',
+    'cachedir': os.getenv('HOME') + '/.ut2004/Cache/',
+    'catalog': '',
+    'configfile': 'utcachex.conf',
+    'debounce': '2',
+    'dedup': 'False',
+    'bytespersec': '0',
+    'exportall': 'False',
+    'filespersec': '0',
+    'gamedir': '',
+    'idleio': 'False',
+    'incremental': 'False',
+    'installmode': 'move',
+    'jobs': '1',
+    'listbackups': 'False',
+    'loglevel': '20',
+    'logfile': 'utcachex.log',
+    'metrics': '',
+    'neededby': '',
+    'order': 'cache',
+    'output': 'text',
+    'processes': '0',
+    'profile': '',
+    'progress': 'False',
+    'redirectdir': '',
+    'restorebackup': '',
+    'stats': '',
+    'streaming': 'False',
+    'syncevery': '64',
+    'targetdir': os.getenv('HOME') + '/.ut2004/',
+    'verify': 'False',
+    'watch': 'False',
+}
 
 # Options -h and --help are automatically created
 cliparser = argparse.ArgumentParser(
@@ -78,7 +112,46 @@ cliparser.add_argument(
     dest='backupsN',
     help='keep only the latest %(metavar)s cache.ini backups; if set to 0, '
          'all existing backups will be deleted and none will be created; '
-         'if set to -1, all backups will be kept (default: 5)'
+         'if set to -1, all backups will be kept; the backups are stored '
+         'compressed, as differences from the previous ones, in the '
+         'cache.ini.backups folder in the cache folder (default: 5)'
+)
+cliparser.add_argument(
+    '--list-backups',
+    action='store_true',
+    dest='listbackups',
+    help='list the ids of the stored cache.ini backups, then exit'
+)
+cliparser.add_argument(
+    '--redirect',
+    # Let this default to None
+    metavar='PATH',
+    dest='redirectdir',
+    help='after moving the files, compress them to the .uz2 format in the '
+         '%(metavar)s folder, for a redirect server; the .uz2 files whose '
+         'sources have not changed since the last export, according to the '
+         '.utcachex.uz2.json file in %(metavar)s, are not compressed again '
+         '(see also --export-all and --processes options)'
+)
+cliparser.add_argument(
+    '--restore-backup',
+    # Let this default to None
+    metavar='ID',
+    dest='restorebackup',
+    help='overwrite cache.ini with the backup %(metavar)s (or the most '
+         'recent one if %(metavar)s is "latest"), after backing up the '
+         'current cache.ini, then exit'
+)
+cliparser.add_argument(
+    '--batch',
+    # Let this default to None
+    metavar='FILE',
+    dest='batch',
+    help='process all the installs listed in %(metavar)s concurrently, '
+         'instead of the --cache and --target ones; every line of '
+         '%(metavar)s holds a cache folder and the corresponding target '
+         'folder, separated by whitespace (use quotes for paths with '
+         'spaces); implies --auto (see also --processes option)'
 )
 cliparser.add_argument(
     '-c',
@@ -89,6 +162,17 @@ cliparser.add_argument(
     help='set the cache folder to %(metavar)s: this is where the downloaded '
          'files and the cache.ini file are (default: ~/.ut2004/Cache/)'
 )
+cliparser.add_argument(
+    '--catalog',
+    # Let this default to None
+    metavar='FILE',
+    dest='catalog',
+    help='record every moved file, with the GUID of its package, its size, '
+         'the time and the cache folder, in the SQLite database %(metavar)s; '
+         'the catalog also tells where the already existing files come from, '
+         'and with --dedup the files reinstalled from the same package are '
+         'not hashed (see also the query command)'
+)
 cliparser.add_argument(
     '-o',
     '--config',
@@ -98,6 +182,83 @@ cliparser.add_argument(
     help='set the configuration file name: a relative or full path can be '
          'specified (default: ./utcachex.conf)'
 )
+cliparser.add_argument(
+    '--debounce',
+    # Let this default to None
+    type=float,
+    metavar='SECONDS',
+    dest='debounce',
+    help='in watch mode, wait until the cache folder has not changed for '
+         '%(metavar)s seconds before extracting the new files (default: 2)'
+)
+cliparser.add_argument(
+    '--dedup',
+    action='store_true',
+    dest='dedup',
+    help='when a file already exists in the target folder, compare the '
+         'contents: if they are identical remove the file from the cache '
+         'and its line from cache.ini, otherwise report a conflict; hashes '
+         'are remembered in the utcachex.hashes file in the cache folder'
+)
+cliparser.add_argument(
+    '--export-all',
+    action='store_true',
+    dest='exportall',
+    help='with --redirect, export all the files in the Animations, Maps, '
+         'Music, Sounds, StaticMeshes, System and Textures folders, not only '
+         'the ones just moved from the cache'
+)
+cliparser.add_argument(
+    '--game-dir',
+    # Let this default to None
+    metavar='DIR',
+    dest='gamedir',
+    help='the folder where the game is installed, whose packages satisfy the '
+         'dependencies too (see --needed-by option); without it the stock '
+         'packages, e.g. Core and Engine, are reported as unresolved'
+)
+cliparser.add_argument(
+    '--idle-io',
+    action='store_true',
+    dest='idleio',
+    help='move the files with the idle I/O priority, so that the disk is '
+         'used only when no other program needs it (Linux only)'
+)
+cliparser.add_argument(
+    '-i',
+    '--incremental',
+    action='store_true',
+    dest='incremental',
+    help='only check the lines appended to cache.ini since the last run, '
+         'remembering the already processed part in the cache.ini.state '
+         'file in the cache folder; the whole file is checked again if that '
+         'part has changed'
+)
+cliparser.add_argument(
+    '--install-mode',
+    # Let this default to None
+    choices=('move', 'hardlink', 'reflink', 'symlink'),
+    dest='installmode',
+    help='how to install the files: move removes them from the cache and '
+         'their lines from cache.ini; hardlink, reflink and symlink leave '
+         'them in the cache, where the game can still find them, and create '
+         'a hard link, a copy-on-write clone or a symbolic link in the target '
+         'folder, which on the same filesystem only writes metadata; hard '
+         'links and clones fall back to copies where they are not supported; '
+         'BEWARE, the symbolic links break if the files are deleted from the '
+         'cache, for example by the gc command (default: move)'
+)
+cliparser.add_argument(
+    '-j',
+    '--jobs',
+    # Let this default to None
+    type=int,
+    metavar='N',
+    dest='jobs',
+    help='move the files using %(metavar)s parallel threads, useful for big '
+         'caches on slow disks or network filesystems; target directories '
+         'are always created first (default: 1)'
+)
 cliparser.add_argument(
     '-l',
     '--loglevel',
@@ -119,6 +280,132 @@ cliparser.add_argument(
     help='set the log file name: a relative or full path can be specified '
          '(default: ./utcachex.log, see also --loglevel option)'
 )
+cliparser.add_argument(
+    '--max-bytes-per-sec',
+    # Let this default to None
+    type=size,
+    metavar='SIZE',
+    dest='bytespersec',
+    help='copy at most %(metavar)s bytes per second (with a K, M, G or T '
+         'suffix for powers of 1024), to avoid slowing down the other '
+         'programs using the disk, for example a game server; renames and '
+         'links are not limited; 0 means no limit (default: 0)'
+)
+cliparser.add_argument(
+    '--max-files-per-sec',
+    # Let this default to None
+    type=float,
+    metavar='N',
+    dest='filespersec',
+    help='move or remove at most %(metavar)s files per second; 0 means no '
+         'limit (default: 0)'
+)
+cliparser.add_argument(
+    '--metrics',
+    # Let this default to None
+    metavar='FILE',
+    dest='metrics',
+    help='at the end of every run write its duration, status, moved files '
+         'and bytes, errors and the entries left in cache.ini to %(metavar)s '
+         'in the text format of Prometheus, e.g. in the textfile collector '
+         'folder of node_exporter; in batch mode one series is written for '
+         'every install'
+)
+cliparser.add_argument(
+    '--needed-by',
+    # Let this default to None
+    action='append',
+    metavar='PACKAGE',
+    dest='neededby',
+    help='only move the packages that %(metavar)s, a map or a package name '
+         'or file name, imports directly or through other packages and '
+         'that are missing from the target folder, reading the import '
+         'tables of the packages in the cache and in the target folder (and '
+         'in the game folder, see --game-dir option); the imports that '
+         'can\'t be found are reported; can be repeated; the whole cache.ini '
+         'is checked, even with --incremental'
+)
+cliparser.add_argument(
+    '--order',
+    # Let this default to None
+    choices=('cache', 'largest', 'inode'),
+    dest='order',
+    help='the order in which the files are moved: as listed in cache.ini, '
+         'or grouped by filesystem and target folder and then the largest '
+         'first or by inode number of the cache file, which reduces the '
+         'disk seeks; in streaming mode the files are sorted within each '
+         'batch (default: cache)'
+)
+cliparser.add_argument(
+    '--output',
+    # Let this default to None
+    choices=('text', 'ndjson', 'json', 'summary'),
+    dest='output',
+    help='how to show the cache.ini entries before moving the files: text '
+         'shows the files to be moved; ndjson and json write a record for '
+         'every entry, with its cache name, real name, destination, decision '
+         'and reason, as a JSON object per line or as a single JSON array; '
+         'summary only writes the counts of the decisions for every '
+         'destination folder (default: text)'
+)
+cliparser.add_argument(
+    '--processes',
+    # Let this default to None
+    type=int,
+    metavar='N',
+    dest='processes',
+    help='in batch mode, process up to %(metavar)s installs at the same '
+         'time, and compress or decompress up to %(metavar)s .uz2 files at '
+         'the same time (see --redirect option and ingest command); 0 means '
+         'as many as the available CPUs '
+         '(default: 0)'
+)
+cliparser.add_argument(
+    '--profile',
+    # Let this default to None
+    metavar='FILE',
+    dest='profile',
+    help='run under cProfile and save the profiling data to %(metavar)s, '
+         'which can be read with the pstats module'
+)
+cliparser.add_argument(
+    '--progress',
+    action='store_true',
+    dest='progress',
+    help='while moving the files show the files and MB moved, the files and '
+         'MB per second and the estimated time left on a line of stderr '
+         'updated in place, or log them every 10 seconds if stderr is not a '
+         'terminal; not shown in batch mode'
+)
+cliparser.add_argument(
+    '--stats',
+    # Let this default to None
+    choices=('text', 'json'),
+    dest='stats',
+    help='log the durations of the phases of the run and the counters of '
+         'moved bytes, stat calls and skipped files, in text or json format'
+)
+cliparser.add_argument(
+    '--stream',
+    action='store_true',
+    dest='streaming',
+    help='move the files while reading cache.ini, in batches, writing the '
+         'lines to be kept to cache.ini.tmp as they are checked, so that the '
+         'memory used doesn\'t grow with the size of cache.ini; the folders '
+         'are not listed in advance, and no confirmation is asked since the '
+         'files are moved before the preview is complete'
+)
+cliparser.add_argument(
+    '--sync-every',
+    # Let this default to None
+    type=int,
+    metavar='N',
+    dest='syncevery',
+    help='sync the journal of the completed moves, and the folders '
+         'involved, to disk every %(metavar)s moved files; a run interrupted '
+         'while moving files is recovered at the next start using the '
+         'cache.ini.journal file in the cache folder (default: 64)'
+)
 cliparser.add_argument(
     '-t',
     '--target',
@@ -128,6 +415,24 @@ cliparser.add_argument(
     help='set the target folder to %(metavar)s: this is where Maps, System, '
          'Textures... folders are (default: ~/.ut2004/)'
 )
+cliparser.add_argument(
+    '--verify',
+    action='store_true',
+    dest='verify',
+    help='check the header of every file before moving it: packages must '
+         'have a valid Unreal package signature and version, complete '
+         'tables and the GUID of their cache file name, music files must be '
+         'Ogg files; the files that fail are left in the cache; the files '
+         'with an unknown extension are moved if their content tells where '
+         'they belong'
+)
+cliparser.add_argument(
+    '--watch',
+    action='store_true',
+    dest='watch',
+    help='keep running and extract the new files as soon as they are added '
+         'to the cache; implies --auto (see also --debounce option)'
+)
 cliparser.add_argument(
     '-v',
     '--version',
@@ -137,21 +442,163 @@ cliparser.add_argument(
     help='show program\'s version number, copyright and license information, '
          'then exit'
 )
-cliargs = cliparser.parse_args()
 
-if cliargs.configfile == None and os.path.isfile(config.get('configfile')):
-    config.update(config.get('configfile'))
-elif cliargs.configfile != None:
-    config.update(cliargs.configfile)
+# Without a command, the files are extracted from the cache
+commands = cliparser.add_subparsers(
+    dest='command',
+    metavar='COMMAND',
+    help='instead of extracting the files, run %(metavar)s (see '
+         '%(prog)s %(metavar)s --help)'
+)
+queryparser = commands.add_parser(
+    'query',
+    help='show where the installed files come from, according to the '
+         'catalog (see --catalog option)',
+    description='Show the installations recorded in the catalog, oldest '
+                'first: time, GUID, destination, size and cache folder '
+                '(or JSON records with --output ndjson or json).'
+)
+queryparser.add_argument(
+    'pattern',
+    nargs='?',
+    metavar='PATTERN',
+    help='only show the installed files whose path ends with %(metavar)s, '
+         'which can contain shell wildcards, e.g. Maps/DM-*.ut2'
+)
+queryparser.add_argument(
+    '--guid',
+    metavar='GUID',
+    dest='guid',
+    help='only show the files installed from the package %(metavar)s'
+)
+gcparser = commands.add_parser(
+    'gc',
+    help='delete the cache files that are not in cache.ini and the '
+         'cache.ini lines of the missing files',
+    description='Delete the cache files that no cache.ini line refers to and '
+                'the cache.ini lines whose file does not exist; with --quota, '
+                'also delete the least recently used files, with their '
+                'lines, until the cache fits in the quota. cache.ini is '
+                'backed up before being changed.'
+)
+gcparser.add_argument(
+    '--quota',
+    type=size,
+    metavar='SIZE',
+    dest='quota',
+    help='the maximum size of the cache files, in bytes or with a K, M, G '
+         'or T suffix (powers of 1024)'
+)
+gcparser.add_argument(
+    '-n',
+    '--dry-run',
+    action='store_true',
+    dest='dryrun',
+    help='only report what would be deleted and the bytes that would be '
+         'reclaimed'
+)
+ingestparser = commands.add_parser(
+    'ingest',
+    help='decompress the .uz2 files of a folder into the install folders',
+    description='Decompress the .uz2 files in SOURCEDIR, for example '
+                'downloaded from a redirect server, into the target folders, '
+                'routing them like the cache files; the existing files are '
+                'never overwritten, and with --dedup they are compared with '
+                'the decompressed content. See also --processes.'
+)
+ingestparser.add_argument(
+    'sourcedir',
+    metavar='SOURCEDIR',
+    help='the folder with the .uz2 files, which are not deleted'
+)
+
+
+def parse(argv=None):
+    """Return the configuration, read from the configuration file and from
+    argv (sys.argv[1:] by default)"""
+    config = configfile.ConfigFile(DEFAULTS)
+    cliargs = cliparser.parse_args(argv)
+
+    if cliargs.configfile == None and os.path.isfile(config.get(
+                                                            'configfile')):
+        config.update(config.get('configfile'))
+    elif cliargs.configfile != None:
+        config.update(cliargs.configfile)
 
-config['autoinput'] = str(cliargs.autoinput)
-if cliargs.backupsN != None:
-    config['backupsN'] = str(cliargs.backupsN)
-if cliargs.cachedir != None:
-    config['cachedir'] = cliargs.cachedir
-if cliargs.loglevel != None:
-    config['loglevel'] = cliargs.loglevel
-if cliargs.logfile != None:
-    config['logfile'] = cliargs.logfile
-if cliargs.targetdir != None:
-    config['targetdir'] = cliargs.targetdir
+    config['autoinput'] = str(cliargs.autoinput)
+    config['command'] = cliargs.command or ''
+    if cliargs.command == 'query':
+        config['pattern'] = cliargs.pattern or ''
+        config['guid'] = cliargs.guid or ''
+    elif cliargs.command == 'gc':
+        config['quota'] = ('' if cliargs.quota == None else
+                           str(cliargs.quota))
+        config['dryrun'] = str(cliargs.dryrun)
+    elif cliargs.command == 'ingest':
+        config['sourcedir'] = cliargs.sourcedir
+    if cliargs.debounce != None:
+        config['debounce'] = str(cliargs.debounce)
+    if cliargs.dedup:
+        config['dedup'] = str(cliargs.dedup)
+    if cliargs.bytespersec != None:
+        config['bytespersec'] = str(cliargs.bytespersec)
+    if cliargs.exportall:
+        config['exportall'] = str(cliargs.exportall)
+    if cliargs.backupsN != None:
+        config['backupsN'] = str(cliargs.backupsN)
+    if cliargs.batch != None:
+        config['batch'] = cliargs.batch
+    if cliargs.cachedir != None:
+        config['cachedir'] = cliargs.cachedir
+    if cliargs.catalog != None:
+        config['catalog'] = cliargs.catalog
+    if cliargs.filespersec != None:
+        config['filespersec'] = str(cliargs.filespersec)
+    if cliargs.gamedir != None:
+        config['gamedir'] = cliargs.gamedir
+    if cliargs.idleio:
+        config['idleio'] = str(cliargs.idleio)
+    if cliargs.incremental:
+        config['incremental'] = str(cliargs.incremental)
+    if cliargs.installmode != None:
+        config['installmode'] = cliargs.installmode
+    if cliargs.jobs != None:
+        config['jobs'] = str(cliargs.jobs)
+    if cliargs.listbackups:
+        config['listbackups'] = str(cliargs.listbackups)
+    if cliargs.loglevel != None:
+        config['loglevel'] = cliargs.loglevel
+    if cliargs.logfile != None:
+        config['logfile'] = cliargs.logfile
+    if cliargs.metrics != None:
+        config['metrics'] = cliargs.metrics
+    if cliargs.neededby != None:
+        config['neededby'] = ','.join(cliargs.neededby)
+    if cliargs.order != None:
+        config['order'] = cliargs.order
+    if cliargs.output != None:
+        config['output'] = cliargs.output
+    if cliargs.processes != None:
+        config['processes'] = str(cliargs.processes)
+    if cliargs.profile != None:
+        config['profile'] = cliargs.profile
+    if cliargs.progress:
+        config['progress'] = str(cliargs.progress)
+    if cliargs.redirectdir != None:
+        config['redirectdir'] = cliargs.redirectdir
+    if cliargs.restorebackup != None:
+        config['restorebackup'] = cliargs.restorebackup
+    if cliargs.stats != None:
+        config['stats'] = cliargs.stats
+    if cliargs.streaming:
+        config['streaming'] = str(cliargs.streaming)
+    if cliargs.syncevery != None:
+        config['syncevery'] = str(cliargs.syncevery)
+    if cliargs.targetdir != None:
+        config['targetdir'] = cliargs.targetdir
+    if cliargs.verify:
+        config['verify'] = str(cliargs.verify)
+    if cliargs.watch:
+        config['watch'] = str(cliargs.watch)
+    
+    return config
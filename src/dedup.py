@@ -0,0 +1,94 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import hashlib
+import json
+import os
+
+BLOCK = 1024 * 1024
+
+
+def hash_file(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(BLOCK)
+            if not block:
+                break
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class HashCache:
+    """Content hashes of files, memoized on disk
+
+    A stored hash is reused only if the inode, size and modification time
+    of the file are unchanged.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.used = set()
+        try:
+            with open(filename, 'r') as f:
+                self.hashes = json.load(f)
+        except (EnvironmentError, ValueError):
+            self.hashes = {}
+
+    def digest(self, path, st=None):
+        path = os.path.abspath(path)
+        if st is None:
+            st = os.stat(path)
+        key = [st.st_ino, st.st_size, st.st_mtime_ns]
+        self.used.add(path)
+        try:
+            entry = self.hashes[path]
+        except KeyError:
+            pass
+        else:
+            if entry[:3] == key:
+                return entry[3]
+        digest = hash_file(path)
+        self.hashes[path] = key + [digest]
+        return digest
+
+    def identical(self, path1, path2):
+        """Return True if the two files have the same content"""
+        st1 = os.stat(path1)
+        st2 = os.stat(path2)
+        if st1.st_size != st2.st_size:
+            return False
+        return self.digest(path1, st1) == self.digest(path2, st2)
+
+    def save(self):
+        # Forget the files that don't exist anymore
+        for path in [path for path in self.hashes if path not in self.used]:
+            if not os.path.isfile(path):
+                del self.hashes[path]
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.hashes, f)
+        os.replace(tmp, self.filename)
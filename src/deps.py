@@ -0,0 +1,113 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+
+import json
+import os
+
+import package
+
+
+class Graph:
+    """The packages imported by the package files, memoized on disk
+
+    The import table of a file is read again only if the inode, size and
+    modification time of the file have changed.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.used = set()
+        try:
+            with open(filename, 'r') as f:
+                self.imports = json.load(f)
+        except (EnvironmentError, ValueError):
+            self.imports = {}
+
+    def dependencies(self, path):
+        """Return the names of the packages imported by the file at path"""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        key = [st.st_ino, st.st_size, st.st_mtime_ns]
+        self.used.add(path)
+        entry = self.imports.get(path)
+        if entry is not None and entry[:3] == key:
+            return entry[3]
+        names = package.imports(path)
+        self.imports[path] = key + [names]
+        return names
+
+    def save(self):
+        # Forget the files that don't exist anymore
+        for path in [path for path in self.imports if path not in self.used]:
+            if not os.path.isfile(path):
+                del self.imports[path]
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.imports, f)
+        os.replace(tmp, self.filename)
+
+
+def closure(roots, locate, graph):
+    """Follow the imports of the packages named in roots
+
+    locate(name) returns the path of the file of the package name, in lower
+    case, or None if it can't be found. Return the paths of the packages
+    found, by lower-case name, the unresolved names, each with the set of
+    the packages that import it (empty for the roots), and the list of the
+    (path, error message) of the files whose imports couldn't be read.
+    """
+    found = {}
+    unresolved = {}
+    failures = []
+    visited = set()
+    queue = [(root, None) for root in roots]
+    while queue:
+        name, importer = queue.pop()
+        key = name.lower()
+        if key in visited:
+            if key in unresolved and importer is not None:
+                unresolved[key][1].add(importer)
+            continue
+        visited.add(key)
+        path = locate(key)
+        if path is None:
+            unresolved[key] = (name, set() if importer is None else
+                                     set((importer,)))
+            continue
+        found[key] = path
+        try:
+            names = graph.dependencies(path)
+        except EnvironmentError as e:
+            failures.append((path, e.strerror))
+            continue
+        except package.PackageError as e:
+            failures.append((path, str(e)))
+            continue
+        for dependency in names:
+            if dependency.lower() != key:
+                queue.append((dependency, name))
+    return found, unresolved, failures
@@ -0,0 +1,1566 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import os as _os
+import re as _re
+import time as _time
+import sqlite3 as _sqlite3
+import functools as _functools
+import itertools as _itertools
+import contextlib as _contextlib
+import concurrent.futures as _futures
+
+import plural
+
+from logger import logger
+from snapshot import Snapshot
+from transfer import Transfer, MODES, fsync_dir, linked
+from dedup import HashCache
+from readstate import ReadState
+from stats import Stats
+from journal import Journal, read as read_journal
+from backups import BackupStore, legacy
+from uz2 import Exporter, installed
+import uz2
+import package
+import deps
+from catalog import Catalog
+import cachegc
+from scheduler import ORDERS, Throttle, order, idle_io
+
+CACHEINI = 'cache.ini'
+CACHEINITMP = 'cache.ini.tmp'
+HASHCACHE = 'utcachex.hashes'
+DEPSCACHE = 'utcachex.deps'
+READSTATE = 'cache.ini.state'
+JOURNAL = 'cache.ini.journal'
+BACKUPDIR = 'cache.ini.backups'
+
+# Files moved or removed per batch in streaming mode
+STREAMBATCH = 4096
+
+# Target subdirectories based on file extension
+PATHS = {
+        '.ukx': 'Animations/',
+        '.ut2': 'Maps/',
+        '.ogg': 'Music/',
+        '.uax': 'Sounds/',
+        '.usx': 'StaticMeshes/',
+        '.u': 'System/',
+        '.utx': 'Textures/'
+        }
+
+# The extension the game expects in each target subdirectory
+EXTENSIONS = dict((path, ext) for ext, path in PATHS.items())
+
+# The lines of cache.ini: entries, section headers and blank lines
+ENTRY = _re.compile('^([0-9A-Z]{32}-[0-9]+)(?:\=)(.+)(\.\w{1,3})(?:\n)$')
+HEADER = _re.compile('^(\[Cache\]|\n)')
+BLANK = _re.compile('^\n')
+
+class CacheFile:
+    """A file to be moved from the cache"""
+    __slots__ = ('cachename', 'realname', 'realext', 'realpath', 'guid')
+
+    def __init__(self, reline):
+        # Retrieve file name strings
+        self.cachename = ''.join((reline.group(1), '.uxx'))
+        self.realname = reline.group(2)
+        self.realext = reline.group(3)
+        self.realpath = ''
+        # The GUID of the package
+        self.guid = reline.group(1)[:32]
+    
+    def setpath(self):
+        # Set the path based on file extension, or don't move the file
+        if self.realext in PATHS:
+            self.realpath = PATHS[self.realext]
+        else:
+            raise CustomError('{} extension not recognized'.format(self.realext
+                                                                   ))
+
+
+class CustomError(Exception):
+    pass
+
+
+class KeptLines:
+    """The lines written to cache.ini.tmp in streaming mode
+
+    retry is the list of the [start, end) ranges of the numbers of the
+    lines that must be checked again by the next run.
+    """
+    def __init__(self, ftmp):
+        self.ftmp = ftmp
+        self.lines = 0
+        self.retry = []
+
+    def write(self, line, processed=True):
+        self.ftmp.write(line)
+        count = line.count('\n')
+        if not processed and count:
+            if self.retry and self.retry[-1][1] == self.lines:
+                self.retry[-1][1] += count
+            else:
+                self.retry.append([self.lines, self.lines + count])
+        self.lines += count
+
+    def flags(self):
+        """Yield for every line written whether it must be checked again"""
+        n = 0
+        for start, end in self.retry:
+            while n < start:
+                yield False
+                n += 1
+            while n < end:
+                yield True
+                n += 1
+        while True:
+            yield False
+
+
+class Result:
+    """The outcome of an extraction run"""
+    def __init__(self):
+        self.status = 0
+        self.moves = 0
+        self.removals = 0
+        self.errors = 0
+        # The lines left in cache.ini
+        self.kept = []
+        # The (cache file, installed file, size) of the moved files
+        self.moved = []
+        # The exported .uz2 files
+        self.exported = []
+        # The (name, importers) of the dependencies that can't be found
+        self.unresolved = []
+        self.stats = Stats()
+
+
+def _make_dirs(movelist, stats):
+    # Create the target directories once, before any file is moved, and
+    # return the ones that couldn't be created
+    faileddirs = set()
+    for dirname in sorted(set(cache_file[1] for cache_file in movelist)):
+        try:
+            stats.count('stat_calls')
+            if not _os.path.isdir(dirname):
+                _os.mkdir(dirname)
+                _os.chmod(dirname, 0o755)
+                stats.count('dirs_created')
+                logger.debug('%s directory created', dirname)
+        except EnvironmentError as e:
+            logger.error('Cannot create %s directory (%s)', e.filename,
+                         e.strerror)
+            faileddirs.add(dirname)
+    return faileddirs
+
+
+def _move_file(transfer, throttle, cache_file):
+    # Executed in the worker threads: only report the result, the logging is
+    # done by the caller in movelist order
+    try:
+        method, size = transfer.install(cache_file[0], cache_file[2])
+    except EnvironmentError as e:
+        return None, 0, e.strerror
+    else:
+        if throttle is not None:
+            # The data copied, if any, has already been charged
+            throttle.spend(1)
+        return method, size, None
+
+
+def _move_files(cachedir, movelist, dontmovelist, jobs, stats, journal=None,
+                moved=None, mode='move', start=0, throttle=None,
+                progress=None):
+    """Move the files in movelist, using jobs threads if jobs > 1
+
+    The lines of the files that couldn't be moved are appended to
+    dontmovelist, the (source, destination, size) of the moved files to
+    moved; return the number of moved files and of errors. With a mode
+    other than move the files stay in the cache, and so do their lines.
+    The moves wait as needed to stay within the budget of throttle, if any;
+    progress, if any, is called with the bytes moved after every file.
+    """
+    moves = 0
+    errors = 0
+    methods = {}
+    
+    faileddirs = _make_dirs(movelist, stats)
+    todolist = [cache_file for cache_file in movelist
+                                           if cache_file[1] not in faileddirs]
+    move_file = _functools.partial(_move_file, Transfer(cachedir, mode,
+                                                        throttle), throttle)
+    
+    # The results are reported while the threads are still moving files
+    with (_futures.ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else
+          _contextlib.nullcontext()) as executor:
+        if executor is not None:
+            results = executor.map(move_file, todolist)
+        else:
+            results = map(move_file, todolist)
+        
+        for n, cache_file in enumerate(movelist, start):
+            if cache_file[1] in faileddirs:
+                dontmovelist.append(cache_file[3])
+                errors += 1
+                if progress is not None:
+                    progress(0)
+                continue
+            
+            method, size, error = next(results)
+            stats.count('stat_calls')
+            if error is not None:
+                logger.error('Cannot move %s to %s (%s)', cache_file[0],
+                             cache_file[2], error)
+                dontmovelist.append(cache_file[3])
+                errors += 1
+            else:
+                logger.debug('%s moved to %s (%s)', cache_file[0],
+                             cache_file[2], method)
+                methods[method] = methods.get(method, 0) + 1
+                stats.count('bytes_moved', size)
+                moves += 1
+                if mode != 'move':
+                    dontmovelist.append(cache_file[3])
+                if journal is not None:
+                    journal.done(n, cache_file[2])
+                if moved is not None:
+                    moved.append((cache_file[0], cache_file[2], size))
+            if progress is not None:
+                progress(size)
+    
+    if methods:
+        logger.debug('Transfer methods: {}'.format(', '.join('{} {}'.format(
+                                  methods[m], m) for m in sorted(methods))))
+    
+    return moves, errors
+
+
+def _is_duplicate(hashcache, cachename, target, stats):
+    stats.count('stat_calls', 2)
+    try:
+        return hashcache.identical(cachename, target)
+    except EnvironmentError as e:
+        logger.error('Cannot compare %s with %s (%s)', cachename, target,
+                     e.strerror)
+        return False
+
+
+def _lookup(catalog, target):
+    # Return the latest installation of target according to the catalog
+    try:
+        return catalog.lookup(target)
+    except _sqlite3.Error as e:
+        logger.error('Cannot read the catalog (%s)', e)
+        return None
+
+
+def _package_name(name):
+    # The package name of a file name or path, with or without extension
+    name = _os.path.basename(name)
+    root, ext = _os.path.splitext(name)
+    return root if ext in PATHS else name
+
+
+def _reinstall(installed, guid, cachename, target, stats):
+    # The catalog says that target has been installed from the same package,
+    # it is still the same file, untouched since then, and the cache file
+    # has the same size: otherwise the files must be compared
+    if (installed is None or installed['guid'] != guid or
+                                            installed['inode'] is None):
+        return False
+    stats.count('stat_calls', 2)
+    try:
+        st = _os.stat(target)
+        size = _os.stat(cachename).st_size
+    except EnvironmentError:
+        return False
+    return (st.st_ino == installed['inode'] and
+            st.st_mtime_ns == installed['mtime'] and
+            st.st_size == installed['size'] == size)
+
+
+def _log_plan(plan, reclaimed, state):
+    logger.info('{} orphan file{P0s}, {} dead line{P1s}, {} evicted '
+                'file{P2s}: {} bytes {}, {} bytes left in the cache'.format(
+                        len(plan.orphans), len(plan.deadlines),
+                        len(plan.evicted), reclaimed, state, plan.used,
+                        **plural.set((len(plan.orphans), len(plan.deadlines),
+                                      len(plan.evicted)))))
+
+
+def _remove_duplicates(duplicatelist, dontmovelist, journal=None, start=0,
+                       throttle=None, progress=None):
+    """Remove from the cache the files already installed with the same
+    content
+
+    The lines of the files that couldn't be removed are appended to
+    dontmovelist; return the number of removed files and of errors.
+    """
+    removals = 0
+    errors = 0
+    
+    for n, (cachename, line) in enumerate(duplicatelist, start):
+        try:
+            _os.remove(cachename)
+        except EnvironmentError as e:
+            logger.error('Cannot remove %s (%s)', cachename, e.strerror)
+            dontmovelist.append(line)
+            errors += 1
+        else:
+            logger.debug('%s removed', cachename)
+            removals += 1
+            if throttle is not None:
+                throttle.spend(1)
+            if journal is not None:
+                journal.done(n)
+        if progress is not None:
+            progress(0)
+    
+    return removals, errors
+
+
+def _next_batch(decisions, kept, readstate=None):
+    # Write the lines to be kept until a batch of files to be moved or
+    # removed is ready
+    movelist, duplicatelist = [], []
+    for decision, item in decisions:
+        if decision == 'keep':
+            kept.write(item)
+        elif decision == 'retry':
+            kept.write(item, processed=False)
+            if readstate is not None:
+                readstate.hold()
+        elif decision == 'move':
+            movelist.append(item)
+        else:
+            duplicatelist.append(item)
+        if len(movelist) + len(duplicatelist) >= STREAMBATCH:
+            break
+    return movelist, duplicatelist
+
+
+def _save_readstate(readstate):
+    try:
+        readstate.save()
+    except EnvironmentError as e:
+        logger.error('Couldn\'t save {} ({})'.format(e.filename, e.strerror))
+
+
+def _open_tmp(cachedir):
+    tmp = _os.path.join(cachedir, CACHEINITMP)
+    if _os.path.isfile(tmp):
+        logger.warning('Overwriting existing cache.ini.tmp')
+        open(tmp, 'w').close()
+    return open(tmp, 'a')
+
+
+def _replace(cachedir):
+    try:
+        _os.replace(_os.path.join(cachedir, CACHEINITMP),
+                    _os.path.join(cachedir, CACHEINI))
+        fsync_dir(cachedir)
+    except EnvironmentError:
+        logger.critical('Couldn\' t overwrite cache.ini (the '
+                        'old version) with cache.ini.tmp (the '
+                        'updated version), please do it manually')
+        raise
+    else:
+        logger.info('cache.ini correctly updated')
+
+
+class Extractor:
+    """Move the files of a cache to the corresponding install folders
+
+    Nothing is printed and no question is asked: subclasses can override
+    show() and confirm() to preview the moves and to ask for confirmation.
+    The same instance can be run any number of times.
+    """
+    # Wrapped around the word ERROR in the summary message
+    errorcode = ''
+    resetcode = ''
+    # Whether planned() gets the total size of the files to be moved
+    measure = False
+
+    def __init__(self, cachedir, targetdir, backupsN=5, jobs=1, dedup=False,
+                 incremental=False, syncevery=64, redirectdir=None,
+                 exportall=False, processes=0, verify=False, catalog=None,
+                 installmode='move', streaming=False, order='cache',
+                 bytespersec=0, filespersec=0, idleio=False, neededby=(),
+                 gamedir=None):
+        self.cachedir = cachedir
+        self.targetdir = targetdir
+        self.backupsN = backupsN
+        self.jobs = jobs
+        self.dedup = dedup
+        self.incremental = incremental
+        self.syncevery = syncevery
+        # Where the .uz2 files for the redirect server are exported, if any
+        self.redirectdir = redirectdir
+        self.exportall = exportall
+        self.processes = processes
+        # Check the headers of the files before moving them
+        self.verify = verify
+        # The file name of the SQLite catalog of the moves, if any
+        self.catalog = catalog
+        # 'move', or how the files are linked while staying in the cache
+        self.installmode = installmode
+        # Move the files while reading cache.ini, in constant memory
+        self.streaming = streaming
+        # How the moves are scheduled: their order, the budget of bytes and
+        # files per second (0 for no limit) and the idle I/O priority
+        self.order = order
+        self.bytespersec = bytespersec
+        self.filespersec = filespersec
+        self.idleio = idleio
+        # Move only the packages imported, directly or not, by these maps or
+        # packages, if any, and also look for the imports in gamedir
+        self.neededby = neededby
+        self.gamedir = gamedir
+
+    def show(self, cachename, realname, target, decision, reason):
+        """Called in the preview for every cache.ini entry
+
+        decision is 'move', 'remove' (for the duplicates) or 'keep', reason
+        is None for the files to be moved; target is None if the extension
+        is not recognized.
+        """
+        pass
+
+    def confirm(self, moves, duplicates):
+        """Return whether the files can be moved and the duplicates removed"""
+        return True
+
+    def planned(self, files, size):
+        """Called before files are moved or removed, with their number and,
+        if measure is True, the total size of the ones to be moved, otherwise
+        None; in streaming mode it is called before every batch"""
+        pass
+
+    def progressed(self, size):
+        """Called after every file moved, removed or failed, with the bytes
+        moved"""
+        pass
+
+    def backlog(self):
+        """Return the number of entries in cache.ini, or None if it can't be
+        read"""
+        try:
+            with open(_os.path.join(self.cachedir, CACHEINI), 'r') as \
+                                                                    cacheini:
+                return sum(1 for line in cacheini if ENTRY.match(line))
+        except EnvironmentError:
+            return None
+
+    def backups(self):
+        """Return the ids of the stored cache.ini backups, oldest first"""
+        return BackupStore(_os.path.join(self.cachedir, BACKUPDIR)).ids()
+
+    def _backup(self):
+        """Back up cache.ini and delete the obsolete backups"""
+        if self.backupsN == 0:
+            # No backups are wanted: delete the existing ones, including
+            # those of older versions
+            try:
+                BackupStore(_os.path.join(self.cachedir, BACKUPDIR)).prune(0)
+                for path, timestamp in legacy(self.cachedir):
+                    _os.remove(path)
+            except EnvironmentError as e:
+                logger.error('Couldn\'t delete obsolete backups: {} '
+                             '({})'.format(e.filename, e.strerror))
+            return
+        
+        try:
+            store = BackupStore(_os.path.join(self.cachedir, BACKUPDIR))
+            if not store.generations:
+                store.migrate(self.cachedir)
+            with open(_os.path.join(self.cachedir, CACHEINI), 'r') as \
+                                                                    cacheini:
+                gid = store.add(cacheini.readlines())
+        except (EnvironmentError, ValueError):
+            logger.critical('Couldn\'t create a backup for cache.ini, '
+                            'to complete the operations you have to '
+                            'overwrite it manually with cache.ini.tmp '
+                            '(which is the updated version)')
+            raise
+        else:
+            logger.info('cache.ini backup {} successfully created'.format(
+                                                                        gid))
+        
+        if self.backupsN > 0:
+            try:
+                store.prune(self.backupsN)
+            except EnvironmentError as e:
+                logger.error('Couldn\'t delete obsolete '
+                             'backups: {} ({})'.format(e.filename,
+                                                       e.strerror))
+
+    def restore_backup(self, gid):
+        """Overwrite cache.ini with the backup gid, backing it up first"""
+        try:
+            store = BackupStore(_os.path.join(self.cachedir, BACKUPDIR))
+            ids = store.ids()
+            if gid == 'latest' and ids:
+                gid = ids[-1]
+            if gid not in ids:
+                logger.critical('Backup {} does not exist'.format(gid))
+                return 1
+            lines = store.restore(gid)
+            with _open_tmp(self.cachedir) as ftmp:
+                for line in lines:
+                    ftmp.write(line)
+                ftmp.flush()
+                _os.fsync(ftmp.fileno())
+            self._backup()
+            _replace(self.cachedir)
+        except (EnvironmentError, ValueError) as e:
+            logger.critical('Cannot restore backup {} ({})'.format(gid, e))
+            return 1
+        logger.info('cache.ini restored from backup {}'.format(gid))
+        return 0
+
+    def collect(self, quota=None, dryrun=False):
+        """Delete the orphan cache files and the cache.ini lines of the
+        missing files, then the least recently used files until the cache
+        takes at most quota bytes, if quota is not None; return a Result
+
+        With dryrun, only report what would be deleted.
+        """
+        cachedir = self.cachedir
+        result = Result()
+        stats = result.stats
+        
+        if not _os.path.isdir(cachedir):
+            logger.critical('Cannot find {} (check cachedir '
+                            'variable)'.format(cachedir))
+            result.status = 1
+            return result
+        
+        try:
+            if not dryrun:
+                self._recover()
+            with stats.phase('parse'):
+                with open(_os.path.join(cachedir, CACHEINI), 'r') as cacheini:
+                    lines = cacheini.readlines()
+                plan = cachegc.plan(cachedir, lines, quota)
+        except EnvironmentError as e:
+            logger.critical('Cannot read the cache ({}: {})'.format(
+                                                    e.filename, e.strerror))
+            result.status = 1
+            return result
+        
+        for name in plan.orphans:
+            logger.debug('%s is not in cache.ini', name)
+        for line in plan.deadlines:
+            logger.debug('%s does not exist', line.split('=', 1)[0] + '.uxx')
+        for name in plan.evicted:
+            logger.debug('%s is evicted', name)
+        stats.count('gc_orphans', len(plan.orphans))
+        stats.count('gc_dead_lines', len(plan.deadlines))
+        stats.count('gc_evicted', len(plan.evicted))
+        reclaimed = plan.reclaimed()
+        result.kept = plan.kept
+        
+        if dryrun:
+            _log_plan(plan, reclaimed, 'reclaimable')
+            return result
+        
+        if plan.deadlines or plan.evicted:
+            # The lines go first: a line whose file has been deleted would
+            # make the game think that the package is in the cache
+            try:
+                with stats.phase('rewrite'):
+                    with _open_tmp(cachedir) as ftmp:
+                        for line in plan.kept:
+                            ftmp.write(line)
+                        ftmp.flush()
+                        _os.fsync(ftmp.fileno())
+                with stats.phase('backup'):
+                    self._backup()
+                with stats.phase('rename'):
+                    _replace(cachedir)
+            except (EnvironmentError, ValueError) as e:
+                logger.critical('Cannot update cache.ini ({}), no file has '
+                                'been deleted'.format(e))
+                result.status = 1
+                return result
+        
+        with stats.phase('delete'):
+            for name in plan.orphans + plan.evicted:
+                try:
+                    _os.remove(_os.path.join(cachedir, name))
+                except EnvironmentError as e:
+                    logger.error('Cannot remove %s (%s)', name, e.strerror)
+                    reclaimed -= plan.sizes[name]
+                    result.errors += 1
+                else:
+                    result.removals += 1
+        stats.count('gc_bytes', reclaimed)
+        stats.count('errors', result.errors)
+        
+        _log_plan(plan, reclaimed, 'reclaimed')
+        return result
+
+    def ingest(self, sourcedir):
+        """Decompress the .uz2 files in sourcedir into the install folders,
+        return a Result
+
+        The files are routed like the cache files, and the existing ones are
+        left alone: with dedup the ones with the same content are reported
+        as duplicates, the others as conflicts. The .uz2 files are not
+        deleted.
+        """
+        targetdir = self.targetdir
+        result = Result()
+        stats = result.stats
+        
+        with stats.phase('validation'):
+            for dirname, variable in ((sourcedir, 'SOURCEDIR argument'),
+                                      (targetdir, 'targetdir variable')):
+                if not _os.path.isdir(dirname):
+                    logger.critical('Cannot find {} (check {})'.format(
+                                                            dirname, variable))
+                    result.status = 1
+                    return result
+        
+        jobs, existing = [], []
+        with stats.phase('parse'):
+            snapshot = Snapshot(sourcedir, targetdir, PATHS.values())
+            if snapshot.cachefiles is None:
+                logger.critical('Cannot list {}'.format(sourcedir))
+                result.status = 1
+                return result
+            for name in sorted(snapshot.cachefiles):
+                if not name.endswith('.uz2'):
+                    continue
+                stats.count('uz2_found')
+                realname = name[:-4]
+                realext = _os.path.splitext(realname)[1]
+                src = _os.path.join(sourcedir, name)
+                if realext not in PATHS:
+                    logger.warning('%s extension has not been recognized, %s '
+                                   'will not be ingested', realext, name)
+                    stats.count('skipped_unknown_extension')
+                    self.show(name, realname, None, 'keep',
+                              'unknown_extension')
+                    continue
+                target = _os.path.join(targetdir, PATHS[realext], realname)
+                if snapshot.in_target(PATHS[realext], realname):
+                    existing.append((name, realname, src, target))
+                    continue
+                stats.count('movable')
+                self.show(name, realname, target, 'move', None)
+                jobs.append((src, _os.path.join(targetdir, PATHS[realext]),
+                             target))
+            stats.count('scans', snapshot.scans)
+            stats.count('stat_calls', snapshot.statcalls)
+        
+        if existing:
+            with stats.phase('dedup'):
+                result.errors += self._ingested(existing, stats)
+        
+        with stats.phase('move'):
+            faileddirs = _make_dirs(jobs, stats)
+            result.errors += sum(1 for job in jobs if job[1] in faileddirs)
+            jobs = [job for job in jobs if job[1] not in faileddirs]
+            results = uz2.ingest([(src, target) for src, dstdir, target
+                                                        in jobs],
+                                 self.processes)
+            for (src, dstdir, target), (size, error) in zip(jobs, results):
+                if error is not None:
+                    logger.error('Cannot ingest %s (%s)', src, error)
+                    result.errors += 1
+                else:
+                    logger.debug('%s ingested to %s', src, target)
+                    stats.count('bytes_moved', size)
+                    result.moves += 1
+                    result.moved.append((src, target, size))
+            for dirname in set(dstdir for src, dstdir, target in jobs):
+                try:
+                    fsync_dir(dirname)
+                except EnvironmentError as e:
+                    logger.error('Cannot sync %s (%s)', dirname, e.strerror)
+        stats.count('uz2_ingested', result.moves)
+        stats.count('errors', result.errors)
+        
+        message = '{} file{P0s} ingested from {}'.format(result.moves,
+                                    sourcedir, **plural.set((result.moves,)))
+        if result.errors > 0:
+            message += ' ({} {}ERROR{reset}{P0s} reported)'.format(
+                                            result.errors, self.errorcode,
+                                            reset=self.resetcode,
+                                            **plural.set((result.errors,)))
+        logger.info(message)
+        return result
+
+    def _ingested(self, existing, stats):
+        # Apply the rules of the cache files to the .uz2 files whose
+        # destination exists already, return the number of errors
+        if not self.dedup:
+            for name, realname, src, target in existing:
+                logger.warning('%s already exists, %s will not be ingested',
+                               target, name)
+                stats.count('skipped_already_exists')
+                self.show(name, realname, target, 'keep', 'already_exists')
+            return 0
+        
+        errors = 0
+        hashcache = self._hashcache()
+        results = uz2.digests([src for name, realname, src, target
+                                                        in existing],
+                              self.processes)
+        for (name, realname, src, target), (digest, error) in zip(existing,
+                                                                  results):
+            if error is None:
+                try:
+                    stats.count('stat_calls')
+                    identical = hashcache.digest(target) == digest
+                except EnvironmentError as e:
+                    error = e.strerror
+            if error is not None:
+                logger.error('Cannot compare %s with %s (%s)', src, target,
+                             error)
+                errors += 1
+            elif identical:
+                logger.info('%s is identical to %s, it will not be ingested',
+                            name, target)
+                stats.count('duplicates')
+                self.show(name, realname, target, 'keep', 'duplicate')
+            else:
+                logger.warning('%s already exists with a different content, '
+                               '%s will not be ingested', target, name)
+                stats.count('skipped_conflict')
+                self.show(name, realname, target, 'keep', 'conflict')
+        try:
+            hashcache.save()
+        except EnvironmentError as e:
+            logger.error('Couldn\'t save {} ({})'.format(e.filename,
+                                                         e.strerror))
+        return errors
+
+    def _recover(self):
+        """Update cache.ini after a run that was interrupted while moving
+        files
+
+        The lines of the moves that were completed are removed, the others
+        are left in cache.ini.
+        """
+        journalfile = _os.path.join(self.cachedir, JOURNAL)
+        if not _os.path.isfile(journalfile):
+            return
+        logger.warning('Found the journal of an interrupted run, recovering')
+        state = read_journal(journalfile)
+        if state is not None:
+            completed, uncompleted = state
+            if completed:
+                # Remove only one line for each completed move
+                counts = {}
+                for line in completed:
+                    counts[line] = counts.get(line, 0) + 1
+                with open(_os.path.join(self.cachedir, CACHEINI), 'r') as \
+                                                                    cacheini:
+                    lines = cacheini.readlines()
+                with _open_tmp(self.cachedir) as ftmp:
+                    for line in lines:
+                        if counts.get(line, 0) > 0:
+                            counts[line] -= 1
+                        else:
+                            ftmp.write(line)
+                    ftmp.flush()
+                    _os.fsync(ftmp.fileno())
+                self._backup()
+                _replace(self.cachedir)
+            logger.warning('{} interrupted move{P0s} completed, {} rolled '
+                           'back'.format(len(completed), len(uncompleted),
+                                         **plural.set((len(completed),))))
+        _os.remove(journalfile)
+
+    def _verify(self, utfile, stats):
+        """Return True if the header of the cache file is consistent with
+        its name and its destination"""
+        stats.count('verified')
+        try:
+            error = package.verify(_os.path.join(self.cachedir,
+                                                 utfile.cachename),
+                                   utfile.guid, utfile.realpath)
+        except EnvironmentError as e:
+            error = e.strerror
+        if error is None:
+            return True
+        logger.warning('%s (%s) failed the verification (%s), it will be '
+                       'left in the cache', utfile.cachename,
+                       utfile.realname + utfile.realext, error)
+        stats.count('skipped_corrupt')
+        return False
+
+    def _classify(self, utfile, stats):
+        # Set the path of a file with an unknown extension from its content,
+        # and the extension the game expects there
+        try:
+            subdir = package.classify(_os.path.join(self.cachedir,
+                                                    utfile.cachename))
+        except EnvironmentError as e:
+            logger.error('Cannot read %s (%s)', utfile.cachename, e.strerror)
+            return
+        if subdir is not None:
+            logger.info('%s (%s) has been recognized as belonging to %s from '
+                        'its content, it will be installed as %s',
+                        utfile.cachename, utfile.realname + utfile.realext,
+                        subdir, utfile.realname + EXTENSIONS[subdir])
+            stats.count('classified')
+            utfile.realpath = subdir
+            utfile.realext = EXTENSIONS[subdir]
+
+    def _schedule(self, movelist, duplicatelist, stats):
+        # Sort the files to be moved for locality, and announce them
+        if self.order != 'cache':
+            stats.count('stat_calls', len(movelist))
+        movelist = order(movelist, self.order)
+        size = None
+        if self.measure:
+            size = 0
+            for cache_file in movelist:
+                stats.count('stat_calls')
+                try:
+                    size += _os.stat(cache_file[0]).st_size
+                except EnvironmentError:
+                    pass
+        self.planned(len(movelist) + len(duplicatelist), size)
+        return movelist
+
+    @_contextlib.contextmanager
+    def _throttled(self, stats):
+        # Yield the Throttle of the moves, if any, running the block with
+        # the idle I/O priority if requested
+        if self.bytespersec > 0 or self.filespersec > 0:
+            throttle = Throttle(self.bytespersec, self.filespersec)
+        else:
+            throttle = None
+        with (idle_io() if self.idleio else _contextlib.nullcontext()) as \
+                                                                        idle:
+            if self.idleio and not idle:
+                logger.warning('The idle I/O priority is not supported, the '
+                               'files will be moved with the normal one')
+            yield throttle
+        if throttle is not None:
+            stats.count('throttle_wait_ms', int(throttle.waited * 1000))
+
+    def _hashcache(self):
+        return (HashCache(_os.path.join(self.cachedir, HASHCACHE))
+                if self.dedup else None)
+
+    def _readlines(self, cacheini, collect=True):
+        """Return the already processed prefix of cache.ini in incremental
+        mode, or None, the iterable of the lines to be checked and the
+        ReadState in incremental mode
+
+        If collect is False the prefix is an empty string, and its lines
+        must be read with ReadState.prefix before the others.
+        """
+        if not self.incremental or self.neededby:
+            # The lines left in the cache by a selective run must be checked
+            # again by the next one
+            return None, cacheini, None
+        readstate = ReadState(_os.path.join(self.cachedir, READSTATE))
+        prefix = readstate.resume(cacheini, collect)
+        if prefix is not None:
+            logger.debug('Skipping the first {} bytes of cache.ini, '
+                         'already processed'.format(readstate.offset))
+        return prefix, _itertools.chain(readstate.retried(cacheini),
+                                        readstate.lines(cacheini)), readstate
+
+    def _scanned(self, stats, snapshot, hashcache):
+        # Complete the classification of the lines
+        stats.count('scans', snapshot.scans)
+        stats.count('stat_calls', snapshot.statcalls)
+        
+        if hashcache is not None:
+            try:
+                hashcache.save()
+            except EnvironmentError as e:
+                logger.error('Couldn\'t save {} ({})'.format(e.filename,
+                                                             e.strerror))
+
+    def _needed(self, result):
+        """Return the lower-case names of the packages in the cache needed by
+        the neededby packages and missing from targetdir and gamedir
+
+        The unresolved dependencies are logged and added to result.
+        """
+        stats = result.stats
+        cached = {}
+        with open(_os.path.join(self.cachedir, CACHEINI), 'r') as cacheini:
+            for line in cacheini:
+                reline = ENTRY.match(line)
+                if reline and reline.group(3) in PATHS:
+                    utfile = CacheFile(reline)
+                    cached.setdefault(utfile.realname.lower(),
+                                      _os.path.join(self.cachedir,
+                                                    utfile.cachename))
+        # The files in targetdir take precedence over the stock ones
+        present = {}
+        for root in (self.targetdir, self.gamedir):
+            if root:
+                for path in installed(root, PATHS):
+                    present.setdefault(_os.path.splitext(
+                            _os.path.basename(path))[0].lower(), path)
+        
+        graph = deps.Graph(_os.path.join(self.cachedir, DEPSCACHE))
+        found, unresolved, failures = deps.closure(
+                            [_package_name(root) for root in self.neededby],
+                            lambda key: present.get(key) or cached.get(key),
+                            graph)
+        try:
+            graph.save()
+        except EnvironmentError as e:
+            logger.error('Couldn\'t save {} ({})'.format(e.filename,
+                                                         e.strerror))
+        
+        for path, error in failures:
+            logger.warning('Cannot read the imports of %s (%s)', path, error)
+        for key in sorted(unresolved):
+            name, importers = unresolved[key]
+            logger.warning('%s, needed by %s, is neither installed nor in '
+                           'the cache', name, ', '.join(sorted(importers))
+                                              or 'the command line')
+            result.unresolved.append((name, sorted(importers)))
+        needed = set(key for key in found if key not in present)
+        stats.count('deps_packages', len(found))
+        stats.count('deps_needed', len(needed))
+        stats.count('deps_unresolved', len(unresolved))
+        stats.count('deps_unreadable', len(failures))
+        logger.info('{} package{P0s} needed, {} missing from {}, {} '
+                    'unresolved'.format(len(found), len(needed),
+                                        self.targetdir, len(unresolved),
+                                        **plural.set((len(found),))))
+        return needed
+
+    def _decisions(self, lines, known, stats, snapshot, hashcache, catalog,
+                   needed=None):
+        """Classify the lines of cache.ini one at a time
+
+        Yield ('keep', line) for the lines to be left in cache.ini,
+        ('retry', line) for the ones left in cache.ini for a reason that
+        can go away, which must be checked again by the next incremental
+        run, ('move', (source, target directory, target, line)) for the files
+        to be moved and ('remove', (source, line)) for the duplicates to be
+        removed. The existing files are looked up in catalog, if any. If
+        needed is not None, only the packages whose lower-case names are in
+        it are moved.
+        """
+        cachedir = self.cachedir
+        targetdir = self.targetdir
+        # The destinations of the moves of this run: another entry with the
+        # same real name is left for the next run, which will find the file
+        # installed, instead of racing with the first one
+        targets = set()
+        
+        for line in lines:
+            stats.count('lines')
+            if line in known:
+                # Kept by the previous run in watch mode, maybe only until
+                # its file appears
+                stats.count('skipped_known')
+                yield 'retry', line
+                continue
+            
+            dontmove = False
+            retry = False
+            
+            reline = ENTRY.match(line)
+            if reline:
+                utfile = CacheFile(reline)
+                realname = utfile.realname + utfile.realext
+                
+                try:
+                    utfile.setpath()
+                except CustomError as e:
+                    if self.verify and snapshot.in_cache(utfile.cachename):
+                        self._classify(utfile, stats)
+                        realname = utfile.realname + utfile.realext
+                    if not utfile.realpath:
+                        logger.warning('%s extension has not been '
+                                       'recognized, %s will be left in the '
+                                       'cache', utfile.realext,
+                                       utfile.cachename)
+                        stats.count('skipped_unknown_extension')
+                        self.show(utfile.cachename, realname, None, 'keep',
+                                  'unknown_extension')
+                        dontmove = True
+                
+                if not dontmove:
+                    target = _os.path.join(targetdir, utfile.realpath,
+                                           realname)
+                    if needed is not None and (utfile.realname.lower() not
+                                               in needed):
+                        logger.debug('%s is not needed, it will be left in '
+                                     'the cache', utfile.cachename)
+                        stats.count('skipped_not_needed')
+                        self.show(utfile.cachename, realname, target, 'keep',
+                                  'not_needed')
+                        dontmove = True
+                        retry = True
+                    
+                    elif not snapshot.in_cache(utfile.cachename):
+                        logger.warning('%s does not exist in the cache, '
+                                     'its line will be left in cache.ini, '
+                                     'but you should probably delete it '
+                                     'manually', utfile.cachename)
+                        stats.count('skipped_missing')
+                        self.show(utfile.cachename, realname, target, 'keep',
+                                  'missing')
+                        dontmove = True
+                        retry = True
+                    
+                    elif snapshot.in_target(utfile.realpath, realname):
+                        installed = (_lookup(catalog, target)
+                                     if catalog is not None else None)
+                        if self.installmode != 'move' and linked(
+                                    self.installmode, _os.path.join(cachedir,
+                                    utfile.cachename), target):
+                            # Installed by a previous run, the file and its
+                            # line stay in the cache
+                            stats.count('skipped_linked')
+                            self.show(utfile.cachename, realname, target,
+                                      'keep', 'linked')
+                            dontmove = True
+                        # The cache files of the other modes must stay in
+                        # the cache, even if identical to the installed ones
+                        elif hashcache is None or self.installmode != 'move':
+                            if installed is not None:
+                                logger.warning('%s already exists (installed '
+                                    'from %s on %s), %s will be left in the '
+                                    'cache', target, installed['guid'],
+                                    _time.strftime('%Y-%m-%d %H:%M:%S',
+                                          _time.localtime(installed['time'])),
+                                    utfile.cachename)
+                            else:
+                                logger.warning('%s already exists, %s will '
+                                               'be left in the cache', target,
+                                               utfile.cachename)
+                            stats.count('skipped_already_exists')
+                            self.show(utfile.cachename, realname, target,
+                                      'keep', 'already_exists')
+                            dontmove = True
+                            retry = True
+                        # A file installed from the same package needn't be
+                        # hashed
+                        elif _reinstall(installed, utfile.guid,
+                                        _os.path.join(cachedir,
+                                                      utfile.cachename),
+                                        target, stats) or _is_duplicate(
+                                        hashcache, _os.path.join(cachedir,
+                                                      utfile.cachename),
+                                        target, stats):
+                            logger.info('%s is identical to %s, it will '
+                                        'be removed from the cache',
+                                        utfile.cachename, target)
+                            stats.count('duplicates')
+                            self.show(utfile.cachename, realname, target,
+                                      'remove', 'duplicate')
+                            yield 'remove', (_os.path.join(cachedir,
+                                                    utfile.cachename), line)
+                            continue
+                        else:
+                            logger.warning('%s already exists with a '
+                                           'different content, %s will be '
+                                           'left in the cache', target,
+                                           utfile.cachename)
+                            stats.count('skipped_conflict')
+                            self.show(utfile.cachename, realname, target,
+                                      'keep', 'conflict')
+                            dontmove = True
+                            retry = True
+                    
+                    elif self.verify and not self._verify(utfile, stats):
+                        self.show(utfile.cachename, realname, target, 'keep',
+                                  'corrupt')
+                        dontmove = True
+                        retry = True
+            
+            else:
+                if not HEADER.match(line):
+                    # Keep the newline in the line written back to
+                    # cache.ini, or the game would append to it
+                    logger.warning('"%s" cannot be recognized, it will be '
+                                   'left in cache.ini', line.rstrip())
+                    stats.count('skipped_unrecognized_line')
+                dontmove = True
+            
+            if not dontmove and target in targets:
+                logger.warning('%s is also going to be installed from '
+                               'another cache file, %s will be left in the '
+                               'cache', target, utfile.cachename)
+                stats.count('skipped_same_target')
+                self.show(utfile.cachename, realname, target, 'keep',
+                          'same_target')
+                dontmove = True
+                retry = True
+            
+            if dontmove:
+                if not BLANK.match(line):
+                    yield ('retry' if retry else 'keep'), line
+            else:
+                targets.add(target)
+                stats.count('movable')
+                self.show(utfile.cachename, realname, target, 'move', None)
+                yield 'move', (_os.path.join(cachedir, utfile.cachename),
+                               _os.path.join(targetdir, utfile.realpath),
+                               target, line)
+        
+    def _preview(self, cacheini, known, stats, catalog=None, needed=None):
+        """Classify the lines of cache.ini
+
+        Return the list of the files to be moved, the list of the lines to be
+        left in cache.ini, the set of the indices of those that must be
+        checked again, the list of the duplicates to be removed and the
+        ReadState in incremental mode. The existing files are looked up in
+        catalog, if any, and only the needed packages are moved, if needed
+        is not None.
+        """
+        movelist, dontmovelist, duplicatelist = [], [], []
+        lists = {'move': movelist, 'keep': dontmovelist,
+                 'retry': dontmovelist, 'remove': duplicatelist}
+        retry = set()
+        snapshot = Snapshot(self.cachedir, self.targetdir, PATHS.values())
+        hashcache = self._hashcache()
+        
+        prefix, lines, readstate = self._readlines(cacheini)
+        if prefix is not None:
+            dontmovelist.append(prefix)
+        for decision, item in self._decisions(lines, known, stats, snapshot,
+                                              hashcache, catalog, needed):
+            if decision == 'retry':
+                retry.add(len(dontmovelist))
+                if readstate is not None:
+                    readstate.hold()
+            lists[decision].append(item)
+        
+        self._scanned(stats, snapshot, hashcache)
+        return movelist, dontmovelist, retry, duplicatelist, readstate
+
+    def _export(self, result):
+        """Export the .uz2 files of the moved files, or of all the
+        installed files if exportall is set"""
+        if self.exportall:
+            files = installed(self.targetdir, PATHS)
+        else:
+            files = [dst for src, dst, size in result.moved]
+        exporter = Exporter(self.redirectdir, self.processes)
+        exported, uptodate, failures = exporter.export(files)
+        try:
+            exporter.save()
+        except EnvironmentError as e:
+            logger.error('Couldn\'t save {} ({})'.format(e.filename,
+                                                         e.strerror))
+        
+        for src, error in failures:
+            logger.error('Cannot export %s (%s)', src, error)
+        for dst, size in exported:
+            logger.debug('%s exported', dst)
+            result.exported.append(dst)
+            result.stats.count('uz2_bytes', size)
+        result.stats.count('uz2_exported', len(exported))
+        result.stats.count('uz2_up_to_date', uptodate)
+        result.stats.count('uz2_errors', len(failures))
+        result.errors += len(failures)
+        if exported or failures:
+            logger.info('{} .uz2 file{P0s} exported to {}, {} up to '
+                        'date'.format(len(exported), self.redirectdir,
+                                      uptodate,
+                                      **plural.set((len(exported),))))
+
+    def run(self, known=()):
+        """Run the extraction once, return a Result
+
+        The cache.ini lines in known are left in cache.ini as they are,
+        without checking them again. If redirectdir is set, the .uz2 files
+        are exported at the end.
+        """
+        catalog = None
+        if self.catalog:
+            try:
+                catalog = Catalog(self.catalog)
+            except _sqlite3.Error as e:
+                logger.error('Cannot open the catalog {} ({}), the moves '
+                             'will not be recorded'.format(self.catalog, e))
+        try:
+            result = self._extract(known, catalog)
+        finally:
+            if catalog is not None:
+                catalog.close()
+        if self.redirectdir and result.status == 0:
+            with result.stats.phase('export'):
+                self._export(result)
+        return result
+
+    def _record(self, catalog, moved):
+        # Add the moved files to the catalog, in a single transaction;
+        # return the number of errors
+        installs = []
+        for src, dst, size in moved:
+            realname, ext = _os.path.splitext(_os.path.basename(dst))
+            try:
+                st = _os.stat(dst)
+            except EnvironmentError:
+                # Without them the file will be hashed to find duplicates
+                inode, mtime = None, None
+            else:
+                inode, mtime = st.st_ino, st.st_mtime_ns
+            installs.append((_os.path.basename(src)[:32], realname, ext, dst,
+                             size, inode, mtime))
+        try:
+            catalog.record(installs, _time.time(), self.cachedir)
+        except _sqlite3.Error as e:
+            logger.error('Cannot record the moves in the catalog ({})'.format(
+                                                                          e))
+            return 1
+        return 0
+
+    def _extract(self, known, catalog):
+        cachedir = self.cachedir
+        result = Result()
+        stats = result.stats
+        
+        with stats.phase('validation'):
+            if not _os.path.isdir(cachedir):
+                logger.critical('Cannot find {} (check cachedir '
+                                'variable)'.format(cachedir))
+                result.status = 1
+                return result
+
+            if not _os.path.isdir(self.targetdir):
+                logger.critical('Cannot find {} (check targetdir '
+                                'variable)'.format(self.targetdir))
+                result.status = 1
+                return result
+
+            if self.installmode not in MODES:
+                logger.critical('{} is not an install mode (check '
+                                'installmode variable)'.format(
+                                                            self.installmode))
+                result.status = 1
+                return result
+
+            if self.redirectdir and not _os.path.isdir(self.redirectdir):
+                logger.critical('Cannot find {} (check redirectdir '
+                                'variable)'.format(self.redirectdir))
+                result.status = 1
+                return result
+
+            if self.gamedir and not _os.path.isdir(self.gamedir):
+                logger.critical('Cannot find {} (check gamedir '
+                                'variable)'.format(self.gamedir))
+                result.status = 1
+                return result
+
+            if self.order not in ORDERS:
+                logger.critical('{} is not a move order (check order '
+                                'variable)'.format(self.order))
+                result.status = 1
+                return result
+
+        with stats.phase('recovery'):
+            try:
+                self._recover()
+            except EnvironmentError as e:
+                logger.critical('Cannot recover the interrupted run ({}: '
+                                '{})'.format(e.filename, e.strerror))
+                result.status = 1
+                return result
+
+        needed = None
+        if self.neededby:
+            with stats.phase('dependencies'):
+                try:
+                    needed = self._needed(result)
+                except EnvironmentError as e:
+                    logger.critical('Cannot resolve the dependencies ({}: '
+                                    '{})'.format(e.filename, e.strerror))
+                    result.status = 1
+                    return result
+
+        try:
+            cacheini = open(_os.path.join(cachedir, CACHEINI),
+                            'rb' if self.incremental and not self.neededby
+                                 else 'r')
+        except EnvironmentError as e:
+            logger.critical('Cannot open {} ({})'.format(e.filename,
+                                                         e.strerror))
+            result.status = 1
+            return result
+        if self.streaming:
+            with cacheini:
+                return self._stream(cacheini, known, catalog, result, needed)
+        with cacheini, stats.phase('parse'):
+            movelist, dontmovelist, retry, duplicatelist, readstate = \
+                    self._preview(cacheini, known, stats, catalog, needed)
+
+        result.kept = dontmovelist
+        
+        if len(movelist) == 0 and len(duplicatelist) == 0:
+            logger.info('There are no files to move')
+            if readstate is not None:
+                _save_readstate(readstate)
+            return result
+
+        if not self.confirm(len(movelist), len(duplicatelist)):
+            logger.info('No changes were made')
+            return result
+        
+        movelist = self._schedule(movelist, duplicatelist, stats)
+        # The linked files stay in the cache with their lines, so only the
+        # moves need journaling
+        moving = self.installmode == 'move'
+        journaled = movelist if moving else []
+        journal = Journal(_os.path.join(cachedir, JOURNAL), self.syncevery,
+                          cachedir)
+        ftmp = None
+        try:
+            ftmp = _open_tmp(cachedir)
+            journal.begin([(cache_file[0], cache_file[2], cache_file[3])
+                                                for cache_file in journaled] +
+                          [(cachename, None, line)
+                                        for cachename, line in duplicatelist])
+        except EnvironmentError as e:
+            logger.critical('Cannot open {} ({})'.format(e.filename,
+                                                         e.strerror))
+            if ftmp is not None:
+                ftmp.close()
+            journal.close()
+            result.status = 1
+            return result
+        else:
+            with ftmp:
+                # The lines of the files that fail to be moved are appended
+                # after the kept ones, and must be checked again
+                decided = len(dontmovelist)
+                with stats.phase('move'), self._throttled(stats) as throttle:
+                    moves, errors = _move_files(cachedir, movelist,
+                                        dontmovelist, self.jobs, stats,
+                                        journal if moving else None,
+                                        result.moved, self.installmode,
+                                        throttle=throttle,
+                                        progress=self.progressed)
+                    removals, rerrors = _remove_duplicates(duplicatelist,
+                                                dontmovelist, journal,
+                                                len(journaled), throttle,
+                                                self.progressed)
+                    journal.sync()
+                if catalog is not None and result.moved:
+                    with stats.phase('catalog'):
+                        errors += self._record(catalog, result.moved)
+                errors += rerrors
+                result.moves = moves
+                result.removals = removals
+                result.errors = errors
+                stats.count('files_moved', moves)
+                stats.count('duplicates_removed', removals)
+                stats.count('errors', errors)
+                
+                with stats.phase('rewrite'):
+                    for line in dontmovelist:
+                        ftmp.write(line)
+                    ftmp.flush()
+                    _os.fsync(ftmp.fileno())
+        
+        self._commit(result, journal, readstate,
+                     lambda readstate: readstate.rewritten(
+                            (line, n in retry or n >= decided)
+                            for n, line in enumerate(dontmovelist)))
+        return result
+
+    def _stream(self, cacheini, known, catalog, result, needed=None):
+        """Classify the lines of cache.ini and move the files in batches,
+        writing the lines to be kept to cache.ini.tmp as they are classified
+
+        The memory used doesn't grow with the size of cache.ini: the
+        directories are not listed, result.kept is left empty and
+        result.moved is filled only if the .uz2 files of the moved files are
+        to be exported. No confirmation is asked, as the files are moved
+        before the preview is complete.
+        """
+        cachedir = self.cachedir
+        stats = result.stats
+        journal = Journal(_os.path.join(cachedir, JOURNAL), self.syncevery,
+                          cachedir)
+        ftmp = None
+        try:
+            ftmp = _open_tmp(cachedir)
+            journal.begin(())
+        except EnvironmentError as e:
+            logger.critical('Cannot open {} ({})'.format(e.filename,
+                                                         e.strerror))
+            if ftmp is not None:
+                ftmp.close()
+            journal.close()
+            result.status = 1
+            return result
+        
+        snapshot = Snapshot(cachedir, self.targetdir, PATHS.values(),
+                            listed=False)
+        hashcache = self._hashcache()
+        with ftmp:
+            kept = KeptLines(ftmp)
+            try:
+                with stats.phase('parse'):
+                    prefix, lines, readstate = self._readlines(cacheini,
+                                                               False)
+                    if prefix is not None:
+                        for line in readstate.prefix(cacheini):
+                            kept.write(line)
+                    decisions = self._decisions(lines, known, stats,
+                                                snapshot, hashcache, catalog,
+                                                needed)
+                with self._throttled(stats) as throttle:
+                    while True:
+                        with stats.phase('parse'):
+                            movelist, duplicatelist = _next_batch(decisions,
+                                                        kept, readstate)
+                        if not movelist and not duplicatelist:
+                            break
+                        with stats.phase('move'):
+                            moved = self._apply(movelist, duplicatelist,
+                                                kept, journal, result,
+                                                throttle)
+                        if catalog is not None and moved:
+                            with stats.phase('catalog'):
+                                result.errors += self._record(catalog, moved)
+                        if self.redirectdir and not self.exportall:
+                            result.moved.extend(moved)
+                
+                with stats.phase('rewrite'):
+                    ftmp.flush()
+                    _os.fsync(ftmp.fileno())
+            except EnvironmentError as e:
+                # The journal is left for the recovery at the next run
+                logger.critical('Cannot continue the run ({}: {}), the '
+                                'moves already completed will be recovered '
+                                'at the next run'.format(e.filename,
+                                                         e.strerror))
+                journal.close()
+                result.status = 1
+                return result
+        
+        self._scanned(stats, snapshot, hashcache)
+        stats.count('files_moved', result.moves)
+        stats.count('duplicates_removed', result.removals)
+        stats.count('errors', result.errors)
+        
+        def rewritten(readstate):
+            with open(_os.path.join(cachedir, CACHEINI), 'r') as newini:
+                readstate.rewritten(zip(newini, kept.flags()))
+        
+        self._commit(result, journal, readstate, rewritten)
+        return result
+
+    def _apply(self, movelist, duplicatelist, kept, journal, result,
+               throttle=None):
+        # Move and remove a batch of files in streaming mode, return the
+        # (source, destination, size) of the moved files
+        movelist = self._schedule(movelist, duplicatelist, result.stats)
+        moving = self.installmode == 'move'
+        journaled = movelist if moving else []
+        start = journal.plan([(cache_file[0], cache_file[2], cache_file[3])
+                                                for cache_file in journaled] +
+                             [(cachename, None, line)
+                                        for cachename, line in duplicatelist])
+        unmoved, moved = [], []
+        moves, errors = _move_files(self.cachedir, movelist, unmoved,
+                                    self.jobs, result.stats,
+                                    journal if moving else None, moved,
+                                    self.installmode, start, throttle,
+                                    self.progressed)
+        removals, rerrors = _remove_duplicates(duplicatelist, unmoved,
+                                               journal, start + len(journaled),
+                                               throttle, self.progressed)
+        journal.sync()
+        # Like in the normal mode, these lines must be checked again
+        for line in unmoved:
+            kept.write(line, processed=False)
+        result.moves += moves
+        result.removals += removals
+        result.errors += errors + rerrors
+        return moved
+
+    def _commit(self, result, journal, readstate, rewritten):
+        """Log the outcome of the moves, then replace cache.ini with
+        cache.ini.tmp if it has changed
+
+        rewritten is called with readstate, in incremental mode, to set the
+        processed part of the new cache.ini and the lines in it to be
+        checked again.
+        """
+        cachedir = self.cachedir
+        stats = result.stats
+        moves, removals, errors = result.moves, result.removals, result.errors
+        moving = self.installmode == 'move'
+        
+        if moves == 0 and removals == 0 and errors == 0:
+            logger.info('There are no files to move')
+        else:
+            filesmoved = '{} file{P0s} {}'.format(moves,
+                                        'moved' if moving else 'installed',
+                                        **plural.set((moves,)))
+            if removals > 0:
+                filesmoved += ', {} duplicate{P0s} removed'.format(removals,
+                                                  **plural.set((removals,)))
+            if errors > 0:
+                filesmoved += ' ({} {}ERROR{reset}{P0s} reported)'.format(
+                                            errors, self.errorcode,
+                                            reset=self.resetcode,
+                                            **plural.set((errors,)))
+            logger.info(filesmoved)
+        
+        # With the link modes cache.ini changes only if duplicates have been
+        # removed
+        if removals > 0 or (moves > 0 and moving):
+            with stats.phase('backup'):
+                self._backup()
+            with stats.phase('rename'):
+                _replace(cachedir)
+                journal.commit()
+            if readstate is not None:
+                rewritten(readstate)
+                _save_readstate(readstate)
+        else:
+            journal.commit()
+            try:
+                _os.remove(_os.path.join(cachedir, CACHEINITMP))
+            except EnvironmentError as e:
+                logger.error('Couldn\'t delete {} ({})'.format(e.filename,
+                                                               e.strerror))
+            if errors == 0 and readstate is not None:
+                # cache.ini is unchanged and all its lines have been
+                # processed
+                _save_readstate(readstate)
+
+
+def extract(cachedir, targetdir, **options):
+    """Run the extraction once with an Extractor, return a Result"""
+    return Extractor(cachedir, targetdir, **options).run()
@@ -0,0 +1,161 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import json
+import os
+
+from transfer import fsync_dir, parts
+
+
+class Journal:
+    """Write-ahead journal of the moves of a run
+
+    All the planned moves are recorded and synced before the first file is
+    moved, or before the first file of their batch when more are planned
+    later; the completed moves are recorded as they happen, but the journal
+    and the directories involved are synced only every syncevery moves.
+    """
+    def __init__(self, filename, syncevery, srcdir):
+        self.filename = filename
+        self.srcdir = srcdir
+        self.syncevery = max(syncevery, 1)
+        self.pending = 0
+        self.dirtydirs = set()
+        self.file = None
+        self.planned = 0
+
+    def begin(self, plans):
+        """Record the planned moves
+
+        plans is a sequence of (source, destination, cache.ini line) tuples,
+        where destination is None for the files to be just removed.
+        """
+        self.file = open(self.filename, 'w')
+        self._write(['BEGIN'])
+        self.plan(plans)
+
+    def plan(self, plans):
+        """Record more planned moves, return the number of the first one"""
+        start = self.planned
+        for n, (src, dst, line) in enumerate(plans, start):
+            self._write(['PLAN', n, src, dst, line])
+        self.planned = start + len(plans)
+        self._sync()
+        return start
+
+    def done(self, n, dst=None):
+        """Record the completion of the planned move number n"""
+        self._write(['DONE', n])
+        self.dirtydirs.add(self.srcdir)
+        if dst is not None:
+            self.dirtydirs.add(os.path.dirname(dst))
+        self.pending += 1
+        if self.pending >= self.syncevery:
+            self.sync()
+
+    def sync(self):
+        """Make the completed moves and their records durable"""
+        for dirname in self.dirtydirs:
+            fsync_dir(dirname)
+        self.dirtydirs.clear()
+        self._sync()
+
+    def commit(self):
+        """Mark the run as completed and delete the journal"""
+        self._write(['COMMIT'])
+        self._sync()
+        self.close()
+        os.remove(self.filename)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _write(self, record):
+        self.file.write(json.dumps(record))
+        self.file.write('\n')
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+
+def read(filename):
+    """Read an interrupted journal
+
+    Return None if the run was committed, otherwise the lists of the
+    cache.ini lines of the completed and of the uncompleted moves.
+    """
+    plans = {}
+    done = set()
+    with open(filename, 'r') as f:
+        for record in f:
+            try:
+                record = json.loads(record)
+            except ValueError:
+                # The last record may have been written only partially
+                break
+            if record[0] == 'PLAN':
+                plans[record[1]] = record[2:]
+            elif record[0] == 'DONE':
+                done.add(record[1])
+            elif record[0] == 'COMMIT':
+                return None
+    
+    # Delete the temporary files of the interrupted copies, listing every
+    # destination directory only once
+    dstnames = {}
+    for src, dst, line in plans.values():
+        if dst is not None:
+            dstdir, dstname = os.path.split(dst)
+            dstnames.setdefault(dstdir, set()).add(dstname)
+    for dstdir in dstnames:
+        try:
+            found = parts(dstdir, dstnames[dstdir])
+        except FileNotFoundError:
+            continue
+        for part in found:
+            os.remove(part)
+    
+    completed, uncompleted = [], []
+    for n in sorted(plans):
+        src, dst, line = plans[n]
+        # A completed move may not have been synced to the journal yet:
+        # a missing source file means that it was completed anyway
+        if n in done or not os.path.exists(src):
+            completed.append(line)
+        elif dst is not None and os.path.isfile(dst) and \
+                        os.path.getsize(dst) == os.path.getsize(src):
+            # A copy to another device was interrupted after the destination
+            # file was synced and renamed, but before the source was removed
+            os.remove(src)
+            completed.append(line)
+        else:
+            uncompleted.append(line)
+    return completed, uncompleted
@@ -25,140 +25,256 @@ subdirectories, renaming them with their real name.
 @license: GPLv3
 """
 
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
+import threading
 
 # loggingext is used indirectly in logger configuration
 import loggingext
 
-from cliargparse import config
+# The maximum number of records written to the log file between two flushes
+BATCH = 256
 
-loglevel = {'console': config.get('loglevel')[0],
+# Create the logger with the loggingext class without changing the class of
+# the loggers created later by whoever imports this module
+_loggerclass = logging.getLoggerClass()
+logging.setLoggerClass(loggingext.Logger)
+logger = logging.getLogger('custom1')
+logging.setLoggerClass(_loggerclass)
+# Until setup() is called the messages are only propagated to the handlers of
+# the application that imported this module, if any
+logger.addHandler(logging.NullHandler())
+
+# The QueueWriter of the log file, if it is written in the background
+_writer = None
+
+
+class QueueWriter:
+    """Pass the records of a QueueHandler to handler in a background thread
+
+    The records that have piled up in the queue are handled together and the
+    handler is flushed once for every batch, instead of after every record.
+    """
+    def __init__(self, queue, handler):
+        self.queue = queue
+        self.handler = handler
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._write,
+                                       name='utcachex-log', daemon=True)
+        self.thread.start()
+
+    def _write(self):
+        stop = False
+        while not stop:
+            records = [self.queue.get()]
+            try:
+                while len(records) < BATCH:
+                    records.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            # StreamHandler.emit flushes the stream after every record
+            self.handler.flush = _noflush
+            try:
+                for record in records:
+                    if record is None:
+                        stop = True
+                    else:
+                        self.handler.handle(record)
+            finally:
+                del self.handler.flush
+                self.handler.flush()
+
+    def stop(self):
+        """Write the records still in the queue, then stop the thread"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+def _noflush():
+    pass
+
+
+def _unqueue():
+    # A forked child doesn't inherit the writer thread: let it write the log
+    # file directly, discarding the parent's records left in its copy of the
+    # queue
+    global _writer
+    if _writer is not None:
+        for handler in logger.handlers[:]:
+            if isinstance(handler, logging.handlers.QueueHandler):
+                logger.removeHandler(handler)
+        logger.addHandler(_writer.handler)
+        _writer = None
+
+os.register_at_fork(after_in_child=_unqueue)
+
+
+def shutdown():
+    """Write all the queued records to the log file and close it"""
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer.handler.close()
+        _writer = None
+
+
+def setup(config):
+    """Configure the handlers according to the loglevel and logfile options
+    of config; the log file is opened here, not at import time"""
+    shutdown()
+    
+    loglevel = {'console': config.get('loglevel')[0],
                                             'file': config.get('loglevel')[1:]}
 
-if loglevel['console'] not in ('0', '1', '2', '3'):
-    loglevel['console'] = '2'
-if loglevel['file'] not in ('0', '1', '2', '3'):
-    loglevel['file'] = '0'
-for k in loglevel:
-    loglevel[k] = int(loglevel[k])
-
-logconfig = {
-    'version': 1,
-    'formatters': {
-        'simple': {
-            'format': '%(asctime)s <%(relativeCreated)d> %(levelname)s: '
+    if loglevel['console'] not in ('0', '1', '2', '3'):
+        loglevel['console'] = '2'
+    if loglevel['file'] not in ('0', '1', '2', '3'):
+        loglevel['file'] = '0'
+    for k in loglevel:
+        loglevel[k] = int(loglevel[k])
+
+    logconfig = {
+        'version': 1,
+        'formatters': {
+            'simple': {
+                'format': '%(asctime)s <%(relativeCreated)d> %(levelname)s: '
                                                                  '%(message)s',
-            'datefmt': '%Y-%m-%d %H:%M:%S'
-        },
-        'simplecol_cyan': {
-            'format': '\033[1;36m%(levelname)s:\033[0m %(message)s'
-        },
-        'simplecol_info': {
-            'format': '\033[1;34m::\033[0m %(message)s'
-        },
-        'simplecol_yellow': {
-            'format': '\033[1;33m%(levelname)s:\033[0m %(message)s'
-        },
-        'simplecol_red': {
-            'format': '\033[1;31m%(levelname)s:\033[0m %(message)s'
-        },
-        'simplecol_default': {
-            'format': '%(levelname)s: %(message)s'
-        },
-        'verbose': {
-            'format': '%(asctime)s <%(relativeCreated)d> [%(pathname)s '
+                'datefmt': '%Y-%m-%d %H:%M:%S'
+            },
+            'simplecol_cyan': {
+                'format': '\033[1;36m%(levelname)s:\033[0m %(message)s'
+            },
+            'simplecol_info': {
+                'format': '\033[1;34m::\033[0m %(message)s'
+            },
+            'simplecol_yellow': {
+                'format': '\033[1;33m%(levelname)s:\033[0m %(message)s'
+            },
+            'simplecol_red': {
+                'format': '\033[1;31m%(levelname)s:\033[0m %(message)s'
+            },
+            'simplecol_default': {
+                'format': '%(levelname)s: %(message)s'
+            },
+            'verbose': {
+                'format': '%(asctime)s <%(relativeCreated)d> [%(pathname)s '
                                       '%(lineno)d] %(levelname)s: %(message)s',
-            'datefmt': '%Y-%m-%d %H:%M:%S'
-        },
-        'verbosecol_cyan': {
-            'format': '%(relativeCreated)d [%(module)s %(lineno)d] '
+                'datefmt': '%Y-%m-%d %H:%M:%S'
+            },
+            'verbosecol_cyan': {
+                'format': '%(relativeCreated)d [%(module)s %(lineno)d] '
                                   '\033[1;36m%(levelname)s:\033[0m %(message)s'
-        },
-        'verbosecol_info': {
-            'format': '%(relativeCreated)d [%(module)s %(lineno)d] '
+            },
+            'verbosecol_info': {
+                'format': '%(relativeCreated)d [%(module)s %(lineno)d] '
                                               '\033[1;34m::\033[0m %(message)s'
-        },
-        'verbosecol_yellow': {
-            'format': '%(relativeCreated)d [%(module)s %(lineno)d] '
+            },
+            'verbosecol_yellow': {
+                'format': '%(relativeCreated)d [%(module)s %(lineno)d] '
                                   '\033[1;33m%(levelname)s:\033[0m %(message)s'
-        },
-        'verbosecol_red': {
-            'format': '%(relativeCreated)d [%(module)s %(lineno)d] '
+            },
+            'verbosecol_red': {
+                'format': '%(relativeCreated)d [%(module)s %(lineno)d] '
                                   '\033[1;31m%(levelname)s:\033[0m %(message)s'
-        },
-        'verbosecol_default': {
-            'format': '%(relativeCreated)d [%(module)s %(lineno)d] '
+            },
+            'verbosecol_default': {
+                'format': '%(relativeCreated)d [%(module)s %(lineno)d] '
                                                    '%(levelname)s: %(message)s'
+            }
+        },
+        'handlers': {
+            'console': {
+                'class': 'loggingext.StreamHandler',
+                'level': ('CRITICAL', 'ERROR', 'INFO', 'DEBUG')[loglevel[
+                                                                   'console']],
+                'formatter': ('simplecol_default', 'simplecol_default',
+                              'simplecol_default', 'verbosecol_default')[
+                                                         loglevel['console']],
+            },
+            'file': {
+                'class': 'loggingext.RotatingFileHandler',
+                'level': ('CRITICAL', 'WARNING', 'INFO', 'DEBUG')[loglevel[
+                                                                      'file']],
+                'formatter': ('simple', 'simple', 'simple', 'verbose')[
+                                                            loglevel['file']],
+                'filename': config.get('logfile'),
+                'maxBytes': (1, 10000, 30000, 100000)[loglevel['file']],
+                'backupCount': 1,
+                'delay': (True, True, False, False)[loglevel['file']]
+            },
+            'null': {
+                'class': 'logging.NullHandler',
+                'formatters': {
+                    'default': 'simple'
+                },
+            }
+        },
+        'loggers': {
+            'custom1': {
+                'level': 'DEBUG',
+                'handlers': [('null', 'console', 'console',
+                               'console')[loglevel['console']],
+                             ('null', 'file', 'file',
+                              'file')[loglevel['file']]],
+                'propagate': False
+            }
+        },
+        'root': {
+            'level': 'DEBUG'
         }
-    },
-    'handlers': {
+    }
+
+    formconfig = {
         'console': {
-            'class': 'loggingext.StreamHandler',
-            'level': ('CRITICAL', 'ERROR', 'INFO', 'DEBUG')[loglevel['console']
-                                                                              ],
-            'formatter': ('simplecol_default', 'simplecol_default',
-                          'simplecol_default', 'verbosecol_default')[loglevel[
-                                                                    'console']],
+            'debug': ('simplecol_default', 'simplecol_cyan',
+                                   'simplecol_cyan',
+                                   'verbosecol_cyan')[loglevel['console']],
+            'info': ('simplecol_default', 'simplecol_info',
+                                   'simplecol_info',
+                                   'verbosecol_info')[loglevel['console']],
+            'warning': ('simplecol_default', 'simplecol_yellow',
+                                 'simplecol_yellow',
+                                 'verbosecol_yellow')[loglevel['console']],
+            'error': ('simplecol_default', 'simplecol_red',
+                   'simplecol_red', 'verbosecol_red')[loglevel['console']],
+            'critical': ('simplecol_default', 'simplecol_red',
+                                     'simplecol_red',
+                                    'verbosecol_red')[loglevel['console']],
         },
         'file': {
-            'class': 'loggingext.RotatingFileHandler',
-            'level': ('CRITICAL', 'WARNING', 'INFO', 'DEBUG')[loglevel['file']],
-            'formatter': ('simple', 'simple', 'simple', 'verbose')[loglevel[
-                                                                       'file']],
-            'filename': config.get('logfile'),
-            'maxBytes': (1, 10000, 30000, 100000)[loglevel['file']],
-            'backupCount': 1,
-            'delay': (True, True, False, False)[loglevel['file']]
+            'warning': ('simple', 'verbose', 'verbose',
+                                              'verbose')[loglevel['file']],
+            'error': ('simple', 'verbose', 'verbose',
+                                              'verbose')[loglevel['file']],
+            'critical': ('simple', 'verbose', 'verbose',
+                                              'verbose')[loglevel['file']],
         },
-        'null': {
-            'class': 'logging.NullHandler',
-            'formatters': {
-                'default': 'simple'
-            },
-        }
-    },
-    'loggers': {
-        'custom1': {
-            'level': 'DEBUG',
-            'handlers': [('null', 'console', 'console',
-                           'console')[loglevel['console']],
-                           ('null', 'file', 'file', 'file')[loglevel['file']]],
-            'propagate': False
-        }
-    },
-    'root': {
-        'level': 'DEBUG'
     }
-}
-
-formconfig = {
-    'console': {
-        'debug': ('simplecol_default', 'simplecol_cyan',
-                               'simplecol_cyan',
-                               'verbosecol_cyan')[loglevel['console']],
-        'info': ('simplecol_default', 'simplecol_info',
-                               'simplecol_info',
-                               'verbosecol_info')[loglevel['console']],
-        'warning': ('simplecol_default', 'simplecol_yellow',
-                             'simplecol_yellow',
-                             'verbosecol_yellow')[loglevel['console']],
-        'error': ('simplecol_default', 'simplecol_red',
-               'simplecol_red', 'verbosecol_red')[loglevel['console']],
-        'critical': ('simplecol_default', 'simplecol_red',
-                                 'simplecol_red',
-                                'verbosecol_red')[loglevel['console']],
-    },
-    'file': {
-        'warning': ('simple', 'verbose', 'verbose',
-                                          'verbose')[loglevel['file']],
-        'error': ('simple', 'verbose', 'verbose',
-                                          'verbose')[loglevel['file']],
-        'critical': ('simple', 'verbose', 'verbose',
-                                          'verbose')[loglevel['file']],
-    },
-}
 
-logging.setLoggerClass(loggingext.Logger)
-loggingext.dictConfig(logconfig, formconfig)
-
-logger = logging.getLogger('custom1')
+    loggingext.dictConfig(logconfig, formconfig)
+    
+    global _writer
+    for handler in logger.handlers[:]:
+        if handler.name == 'file':
+            records = queue.SimpleQueue()
+            queuehandler = logging.handlers.QueueHandler(records)
+            queuehandler.setLevel(handler.level)
+            logger.removeHandler(handler)
+            logger.addHandler(queuehandler)
+            _writer = QueueWriter(records, handler)
+            _writer.start()
+            atexit.unregister(shutdown)
+            atexit.register(shutdown)
+    
+    # Let the disabled levels be discarded by the logger, before a record is
+    # even created
+    levels = [handler.level for handler in logger.handlers
+                            if not isinstance(handler, logging.NullHandler)]
+    logger.setLevel(min(levels) if levels else logging.CRITICAL)
@@ -0,0 +1,82 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+
+import os
+
+PREFIX = 'utcachex_'
+
+# The metrics of a run, all gauges: name and help text, in the order of the
+# values passed to sample()
+METRICS = (
+    ('last_run_timestamp_seconds', 'Start time of the last run.'),
+    ('run_duration_seconds', 'Duration of the last run.'),
+    ('run_status', 'Exit status of the last run, 0 if successful.'),
+    ('files_moved', 'Files installed from the cache by the last run.'),
+    ('duplicates_removed', 'Duplicates removed from the cache by the last '
+                           'run.'),
+    ('bytes_moved', 'Bytes installed from the cache by the last run.'),
+    ('errors', 'Errors reported by the last run.'),
+    ('backlog_files', 'Entries left in cache.ini after the last run.'),
+)
+
+
+def sample(cachedir, start, duration, status, moves, removals, size, errors,
+           backlog):
+    """Return the sample of a run for write(); backlog can be None if it
+    couldn't be counted"""
+    return ({'cachedir': cachedir},
+            (start, duration, status, moves, removals, size, errors,
+             backlog))
+
+
+def _labels(labels):
+    return ','.join('{}="{}"'.format(name, value.replace('\\', '\\\\')
+                                                .replace('"', '\\"')
+                                                .replace('\n', '\\n'))
+                    for name, value in sorted(labels.items()))
+
+
+def write(filename, samples):
+    """Write the samples in the text format of Prometheus, for the textfile
+    collector of node_exporter
+
+    The file is replaced atomically, so that the collector never reads it
+    partially written.
+    """
+    tmp = os.path.join(os.path.dirname(filename),
+                       '.{}.tmp'.format(os.path.basename(filename)))
+    with open(tmp, 'w') as f:
+        for n, (name, text) in enumerate(METRICS):
+            f.write('# HELP {}{} {}\n'.format(PREFIX, name, text))
+            f.write('# TYPE {}{} gauge\n'.format(PREFIX, name))
+            for labels, values in samples:
+                if values[n] is not None:
+                    f.write('{}{}{{{}}} {}\n'.format(PREFIX, name,
+                                                     _labels(labels),
+                                                     values[n]))
+    os.replace(tmp, filename)
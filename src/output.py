@@ -0,0 +1,133 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import collections
+import io
+import json
+import os
+
+# The buffer size of the stream opened by open_stdout()
+BUFSIZE = 1 << 16
+
+
+def open_stdout():
+    """Return a buffered text stream on the standard output, which is not
+    flushed at every line even if it is a terminal"""
+    return io.open(1, 'w', buffering=BUFSIZE, encoding='utf-8',
+                   closefd=False)
+
+
+class Writer:
+    """Write a record for every classified cache.ini entry to stream
+
+    A record has the keys cache, real, destination, decision ('move',
+    'remove' or 'keep') and reason (None for the files to be moved).
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, record):
+        raise NotImplementedError
+
+    def close(self):
+        """Write what is still pending, and flush the stream"""
+        self.stream.flush()
+
+
+class TextWriter(Writer):
+    """The colored preview of the files to be moved"""
+    def __init__(self, stream, head='', arrow='', reset=''):
+        super().__init__(stream)
+        self.head = head
+        self.separator = ' {}-->{} '.format(arrow, reset)
+        self.reset = reset
+        self.started = False
+
+    def write(self, record):
+        if record['decision'] != 'move':
+            return
+        if not self.started:
+            self.stream.write('{}=== PREVIEW ==={}\n'.format(self.head,
+                                                             self.reset))
+            self.started = True
+        self.stream.write(''.join((record['cache'], self.separator,
+                                   record['destination'], '\n')))
+
+
+class NdjsonWriter(Writer):
+    """A JSON object per line"""
+    def write(self, record):
+        self.stream.write(json.dumps(record))
+        self.stream.write('\n')
+
+
+class JsonWriter(Writer):
+    """A single JSON array, written as the records arrive"""
+    def __init__(self, stream):
+        super().__init__(stream)
+        self.separator = '[\n'
+
+    def write(self, record):
+        self.stream.write(self.separator)
+        self.stream.write(json.dumps(record))
+        self.separator = ',\n'
+
+    def close(self):
+        self.stream.write('[]\n' if self.separator == '[\n' else '\n]\n')
+        super().close()
+
+
+class SummaryWriter(Writer):
+    """The counts of the decisions for every destination folder"""
+    def __init__(self, stream):
+        super().__init__(stream)
+        self.counts = collections.OrderedDict()
+
+    def write(self, record):
+        dirname = (os.path.dirname(record['destination'])
+                   if record['destination'] is not None else '(none)')
+        decisions = self.counts.setdefault(dirname, collections.Counter())
+        decisions[record['decision'] if record['reason'] is None else
+                  '{} ({})'.format(record['decision'], record['reason'])] += 1
+
+    def close(self):
+        for dirname in sorted(self.counts):
+            decisions = self.counts[dirname]
+            self.stream.write('{}: {}\n'.format(dirname, ', '.join(
+                                    '{} {}'.format(decisions[decision],
+                                                   decision)
+                                    for decision in sorted(decisions))))
+        self.counts.clear()
+        super().close()
+
+
+WRITERS = {
+    'text': TextWriter,
+    'ndjson': NdjsonWriter,
+    'json': JsonWriter,
+    'summary': SummaryWriter,
+}
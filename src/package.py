@@ -0,0 +1,203 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import mmap
+import struct
+
+SIGNATURE = 0x9E2A83C1
+# The package versions that UT2004 can load, starting from the first one
+# with the GUID in the header
+MINVERSION = 68
+MAXVERSION = 128
+# signature, version, licensee, flags, name/export/import counts and offsets,
+# GUID
+HEADER = struct.Struct('<IHHIIIIIIIIIII')
+# The reference to the outer object of an import, 0 for the packages
+OUTER = struct.Struct('<i')
+OGGMAGIC = b'OggS'
+# The names read at most from the name table when classifying a package
+MAXNAMES = 4096
+
+# The names that identify the kind of content of a package, most specific
+# first: a map also contains textures and static meshes, for example
+KINDS = (
+    ('LevelInfo', 'Maps/'),
+    ('TextBuffer', 'System/'),
+    ('Function', 'System/'),
+    ('MeshAnimation', 'Animations/'),
+    ('SkeletalMesh', 'Animations/'),
+    ('StaticMesh', 'StaticMeshes/'),
+    ('Sound', 'Sounds/'),
+    ('Texture', 'Textures/'),
+)
+
+
+class PackageError(Exception):
+    pass
+
+
+class Header:
+    """The summary at the beginning of an Unreal package"""
+    def __init__(self, buf):
+        if len(buf) < HEADER.size:
+            raise PackageError('truncated header')
+        (signature, self.version, self.licensee, self.flags, self.namecount,
+         self.nameoffset, self.exportcount, self.exportoffset,
+         self.importcount, self.importoffset, *guid) = HEADER.unpack_from(buf)
+        if signature != SIGNATURE:
+            raise PackageError('not an Unreal package')
+        if not MINVERSION <= self.version <= MAXVERSION:
+            raise PackageError('unsupported package version {}'.format(
+                                                                self.version))
+        self.guid = '%08X%08X%08X%08X' % tuple(guid)
+        # Every table entry takes at least a byte
+        for offset, count in ((self.nameoffset, self.namecount),
+                              (self.exportoffset, self.exportcount),
+                              (self.importoffset, self.importcount)):
+            if offset < HEADER.size or offset + count > len(buf):
+                raise PackageError('truncated package')
+
+
+def compact_index(buf, pos):
+    """Decode the variable-length integer at pos, return it and the position
+    following it"""
+    byte = buf[pos]
+    pos += 1
+    value = byte & 0x3F
+    if byte & 0x40:
+        shift = 6
+        for _ in range(4):
+            more = buf[pos]
+            pos += 1
+            value |= (more & 0x7F) << shift
+            shift += 7
+            if not more & 0x80:
+                break
+    return -value if byte & 0x80 else value, pos
+
+
+def names(buf, header, limit=None):
+    """Yield the names of the name table of the package"""
+    pos = header.nameoffset
+    for _ in range(min(header.namecount, limit or header.namecount)):
+        length, pos = compact_index(buf, pos)
+        if length <= 0 or pos + length + 4 > len(buf):
+            raise PackageError('corrupt name table')
+        # The length includes the terminating null, and the name is followed
+        # by its flags
+        yield buf[pos:pos + length - 1].decode('latin-1')
+        pos += length + 4
+
+
+class _Mapped:
+    # Map the whole file read-only: only the pages actually read, i.e. the
+    # header and the tables, are loaded from the disk
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.buf = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        except ValueError:
+            # The file is empty
+            self.buf = b''
+
+    def __enter__(self):
+        return self.buf
+
+    def __exit__(self, *exc):
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
+        self.file.close()
+
+
+def verify(path, guid, subdir):
+    """Check that the file at path is a complete file of the type installed
+    in subdir: Ogg Vorbis for Music/, an Unreal package otherwise
+
+    guid is the one in the cache file name, which must match the one in the
+    package header. Return None if the file looks sane, otherwise the
+    reason why it doesn't.
+    """
+    with _Mapped(path) as buf:
+        if subdir == 'Music/':
+            if buf[:len(OGGMAGIC)] != OGGMAGIC:
+                return 'not an Ogg file'
+            return None
+        try:
+            header = Header(buf)
+        except PackageError as e:
+            return str(e)
+        if header.guid != guid:
+            return 'the package GUID is {}'.format(header.guid)
+    return None
+
+
+def classify(path):
+    """Return the subfolder where the file at path belongs according to its
+    content, or None if it cannot be told"""
+    with _Mapped(path) as buf:
+        if buf[:len(OGGMAGIC)] == OGGMAGIC:
+            return 'Music/'
+        try:
+            header = Header(buf)
+            found = set(names(buf, header, MAXNAMES))
+        except (PackageError, IndexError, struct.error):
+            return None
+    for name, subdir in KINDS:
+        if name in found:
+            return subdir
+    return None
+
+
+def imports(path):
+    """Return the names of the packages imported by the package at path
+
+    They are the objects of the import table without an outer object, in
+    the order of the table; an Ogg file imports nothing.
+    """
+    with _Mapped(path) as buf:
+        if buf[:len(OGGMAGIC)] == OGGMAGIC:
+            return []
+        header = Header(buf)
+        try:
+            table = list(names(buf, header))
+            found = []
+            pos = header.importoffset
+            for _ in range(header.importcount):
+                # Class package and class name
+                _, pos = compact_index(buf, pos)
+                _, pos = compact_index(buf, pos)
+                outer, = OUTER.unpack_from(buf, pos)
+                pos += OUTER.size
+                name, pos = compact_index(buf, pos)
+                if not 0 <= name < len(table):
+                    raise PackageError('corrupt import table')
+                if outer == 0:
+                    found.append(table[name])
+        except (IndexError, struct.error):
+            raise PackageError('corrupt import table')
+    return found
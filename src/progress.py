@@ -0,0 +1,121 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+
+import time
+
+from logger import logger
+
+# Seconds between the updates of the terminal line and of the log lines
+TTYINTERVAL = 0.2
+LOGINTERVAL = 10.0
+MB = 1024 * 1024
+
+
+def _duration(seconds):
+    seconds = int(seconds)
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60,
+                                     seconds % 60)
+
+
+class Progress:
+    """The throughput and the ETA of the moves
+
+    They are shown on a single line updated in place if stream is a
+    terminal, otherwise logged periodically. The totals can grow while the
+    files are being moved, as in streaming mode; if the total size isn't
+    known, the ETA is computed from the number of files.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.tty = stream.isatty()
+        self.interval = TTYINTERVAL if self.tty else LOGINTERVAL
+        self.files = 0
+        self.size = 0
+        self.measured = True
+        self.donefiles = 0
+        self.donesize = 0
+        self.start = None
+        self.last = 0.0
+        self.shown = False
+
+    def plan(self, files, size=None):
+        """Add files, of total size bytes, to the files to be moved"""
+        if self.start is None:
+            self.start = self.last = time.monotonic()
+        self.files += files
+        if size is None:
+            self.measured = False
+        else:
+            self.size += size
+
+    def advance(self, size):
+        """Account for a file processed, size bytes having been moved"""
+        self.donefiles += 1
+        self.donesize += size
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            self._show(now)
+
+    def line(self, now=None):
+        elapsed = max((now or time.monotonic()) - self.start, 1e-6)
+        filerate = self.donefiles / elapsed
+        byterate = self.donesize / elapsed
+        if self.measured and self.size > 0 and byterate > 0:
+            eta = _duration(max(self.size - self.donesize, 0) / byterate)
+        elif filerate > 0:
+            eta = _duration(max(self.files - self.donefiles, 0) / filerate)
+        else:
+            eta = '?'
+        return '{}/{} files, {:.1f}/{} MB, {:.1f} files/s, {:.1f} MB/s, ' \
+               'ETA {}'.format(self.donefiles, self.files,
+                               self.donesize / MB,
+                               '{:.1f}'.format(self.size / MB)
+                                                if self.measured else '?',
+                               filerate, byterate / MB, eta)
+
+    def _show(self, now):
+        if self.tty:
+            # Clear the rest of the previous line
+            self.stream.write('\r\x1b[K' + self.line(now))
+            self.stream.flush()
+            self.shown = True
+        else:
+            logger.info(self.line(now))
+
+    def close(self):
+        """Show the final state"""
+        if self.start is None:
+            return
+        if self.tty:
+            if self.shown:
+                self.stream.write('\r\x1b[K' + self.line() + '\n')
+                self.stream.flush()
+        elif time.monotonic() - self.start >= self.interval:
+            # A short run needs just its summary
+            logger.info(self.line())
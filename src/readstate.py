@@ -0,0 +1,194 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import hashlib
+import json
+import locale
+import os
+
+BLOCK = 1024 * 1024
+
+
+def decode(raw, encoding):
+    # Emulate the universal newlines of text mode
+    line = raw.decode(encoding)
+    if line.endswith('\r\n'):
+        line = line[:-2] + '\n'
+    return line
+
+
+class ReadState:
+    """The part of cache.ini that has already been processed
+
+    The game only appends lines to cache.ini, so the state file records the
+    size and the checksum of the prefix that doesn't have to be parsed
+    again, and the byte ranges of the lines in it that were left for a
+    reason that can go away, which are checked again; if the prefix has
+    changed, the whole file is parsed.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.encoding = locale.getpreferredencoding(False)
+        try:
+            with open(filename, 'r') as f:
+                state = json.load(f)
+            self.saved = (int(state['offset']), state['sha1'],
+                          [(int(start), int(end))
+                                for start, end in state.get('retry', ())])
+        except (EnvironmentError, ValueError, KeyError, TypeError):
+            self.saved = None
+        self.offset = 0
+        self.sha = hashlib.sha1()
+        # The (start, end) byte ranges of the lines of the prefix to be
+        # checked again by the next run, and the ones read by resume() to be
+        # checked again by this one
+        self.retry = []
+        self.pending = []
+        # The range of the line just yielded, None if it is incomplete
+        self.last = None
+
+    def resume(self, f, collect=True):
+        """Skip the processed prefix of the binary file f
+
+        Return the prefix as text, without the lines to be checked again,
+        or None if it doesn't match the saved state, in which case f is read
+        from the beginning. If collect is False, an empty string is returned
+        instead of the prefix.
+        """
+        if self.saved is None:
+            return None
+        offset, digest, retry = self.saved
+        chunks = []
+        sha = hashlib.sha1()
+        remaining = offset
+        while remaining > 0:
+            chunk = f.read(min(BLOCK, remaining))
+            if not chunk:
+                break
+            sha.update(chunk)
+            if collect:
+                chunks.append(chunk)
+            remaining -= len(chunk)
+        if remaining > 0 or sha.hexdigest() != digest:
+            f.seek(0)
+            return None
+        self.offset = offset
+        self.sha = sha
+        self.pending = retry
+        if not collect:
+            return ''
+        data = b''.join(chunks)
+        return ''.join(decode(line, self.encoding)
+                            for piece in self._kept(data, retry)
+                            for line in piece.splitlines(True))
+
+    def _kept(self, data, retry):
+        # Yield the pieces of data outside the retry ranges
+        start = 0
+        for begin, end in retry:
+            yield data[start:begin]
+            start = end
+        yield data[start:]
+
+    def prefix(self, f):
+        """Yield the decoded lines of the processed prefix of the binary
+        file f, reading it again, without the lines to be checked again; f
+        is left at the end of the prefix"""
+        f.seek(0)
+        for begin, end in self.pending + [(self.offset, self.offset)]:
+            remaining = begin - f.tell()
+            while remaining > 0:
+                raw = f.readline(remaining)
+                if not raw:
+                    break
+                remaining -= len(raw)
+                yield decode(raw, self.encoding)
+            f.seek(end)
+
+    def retried(self, f):
+        """Yield the decoded lines of the processed prefix of the binary
+        file f to be checked again; f is left at the end of the prefix"""
+        pending, self.pending = self.pending, []
+        for start, end in pending:
+            f.seek(start)
+            for raw in f.read(end - start).splitlines(True):
+                self.last = (start, start + len(raw))
+                start += len(raw)
+                yield decode(raw, self.encoding)
+        f.seek(self.offset)
+
+    def lines(self, f):
+        """Yield the decoded lines of the binary file f
+
+        The complete lines are added to the processed prefix.
+        """
+        for raw in f:
+            if raw.endswith(b'\n'):
+                self.last = (self.offset, self.offset + len(raw))
+                self.offset += len(raw)
+                self.sha.update(raw)
+            else:
+                self.last = None
+            yield decode(raw, self.encoding)
+
+    def hold(self):
+        """Make the next run check again the line just yielded by retried()
+        or lines()"""
+        if self.last is not None:
+            self._hold(*self.last)
+
+    def _hold(self, start, end):
+        # The ranges are added in order: merge the adjacent ones
+        if self.retry and self.retry[-1][1] == start:
+            self.retry[-1] = (self.retry[-1][0], end)
+        else:
+            self.retry.append((start, end))
+
+    def rewritten(self, lines):
+        """Make the processed prefix the given lines of a rewritten
+        cache.ini, as (text, retry) pairs where retry tells whether the next
+        run must check the text again"""
+        self.offset = 0
+        self.sha = hashlib.sha1()
+        self.retry = []
+        for line, retry in lines:
+            raw = line.encode(self.encoding)
+            if not raw:
+                continue
+            if not raw.endswith(b'\n'):
+                break
+            if retry:
+                self._hold(self.offset, self.offset + len(raw))
+            self.offset += len(raw)
+            self.sha.update(raw)
+
+    def save(self):
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'offset': self.offset, 'sha1': self.sha.hexdigest(),
+                       'retry': self.retry}, f)
+        os.replace(tmp, self.filename)
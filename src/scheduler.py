@@ -0,0 +1,180 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+
+import os
+import time
+import threading
+import platform
+import contextlib
+import ctypes
+
+# The orders in which the files can be moved: as listed in cache.ini,
+# largest first or by inode of the cache file, after grouping them by
+# filesystem and destination directory
+ORDERS = ('cache', 'largest', 'inode')
+
+# The bounds of the size of the chunks copied with a bytes budget: about a
+# tenth of a second's worth, so that large files don't copy in bursts
+MINCHUNK = 64 * 1024
+MAXCHUNK = 16 * 1024 * 1024
+
+# The numbers of the ioprio_get and ioprio_set system calls
+IOPRIO_SYSCALLS = {
+    'x86_64': (252, 251),
+    'i386': (290, 289),
+    'i686': (290, 289),
+    'aarch64': (31, 30),
+    'armv7l': (315, 314),
+}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASS_IDLE = 3
+
+
+def _device(dirname):
+    # The device of dirname, or of its closest existing parent
+    while True:
+        try:
+            return os.stat(dirname).st_dev
+        except EnvironmentError:
+            parent = os.path.dirname(dirname.rstrip(os.sep))
+            if not parent or parent == dirname:
+                return -1
+            dirname = parent
+
+
+def order(movelist, how):
+    """Return movelist sorted for locality
+
+    The entries are (source, destination directory, ...) tuples; unless how
+    is 'cache', a stat call is made for every source file.
+    """
+    if how == 'cache':
+        return movelist
+    devices = {}
+    keys = {}
+    for entry in movelist:
+        dirname = entry[1]
+        if dirname not in devices:
+            devices[dirname] = _device(dirname)
+        try:
+            st = os.stat(entry[0])
+        except EnvironmentError:
+            # The move will fail and be reported anyway
+            key = 0
+        else:
+            key = -st.st_size if how == 'largest' else st.st_ino
+        keys[entry[0]] = (devices[dirname], dirname, key)
+    return sorted(movelist, key=lambda entry: keys[entry[0]])
+
+
+class TokenBucket:
+    """rate tokens per second, of which at most burst can be saved
+
+    Tokens can be spent before they are available: the debt is returned as
+    the time to wait, so that the average rate is respected.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = self.rate if burst is None else float(burst)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+
+    def spend(self, n):
+        """Spend n tokens, return the seconds to wait before going on"""
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= n
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class Throttle:
+    """A budget of bytes and of files per second shared by the move threads
+
+    A limit of 0 means no limit. The bytes are charged by the transfers as
+    they copy the data, chunk by chunk, so the files moved without copying
+    any data only count against the files budget.
+    """
+    def __init__(self, bytespersec=0, filespersec=0):
+        self.bytes = TokenBucket(bytespersec) if bytespersec > 0 else None
+        self.files = TokenBucket(filespersec) if filespersec > 0 else None
+        self.lock = threading.Lock()
+        # The size of the chunks in which the data is copied
+        self.chunk = (min(max(bytespersec // 10, MINCHUNK), MAXCHUNK)
+                      if bytespersec > 0 else MAXCHUNK)
+        # The total time spent waiting, in seconds
+        self.waited = 0.0
+
+    def spend(self, files=0, size=0):
+        """Account for files moved or removed and for size bytes of data
+        copied, waiting as long as needed to stay within the budget"""
+        with self.lock:
+            wait = 0.0
+            if self.files is not None and files:
+                wait = self.files.spend(files)
+            if self.bytes is not None and size:
+                wait = max(wait, self.bytes.spend(size))
+            self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _ioprio_syscalls():
+    numbers = IOPRIO_SYSCALLS.get(platform.machine())
+    if numbers is None:
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.syscall, numbers[0], numbers[1]
+    except (OSError, AttributeError):
+        return None
+
+
+@contextlib.contextmanager
+def idle_io():
+    """Run the block with the idle I/O priority, if the system supports it
+
+    The threads started inside the block inherit the priority, the one of
+    the calling thread is restored at the end; the value of the block is
+    whether the priority could be set.
+    """
+    syscalls = _ioprio_syscalls()
+    old = -1
+    if syscalls is not None:
+        syscall, get, set_ = syscalls
+        old = syscall(get, IOPRIO_WHO_PROCESS, 0)
+        if old < 0 or syscall(set_, IOPRIO_WHO_PROCESS, 0,
+                              IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) < 0:
+            old = -1
+    try:
+        yield old >= 0
+    finally:
+        if old >= 0:
+            syscall(set_, IOPRIO_WHO_PROCESS, 0, old)
@@ -0,0 +1,82 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import errno
+import os
+
+
+def scan(dirname):
+    """Return the set of the names of the regular files in dirname
+
+    A missing directory is considered empty; None is returned if the
+    directory exists but can't be listed.
+    """
+    try:
+        entries = os.scandir(dirname)
+    except EnvironmentError as e:
+        if e.errno in (errno.ENOENT, errno.ENOTDIR):
+            return set()
+        return None
+    with entries:
+        return set(entry.name for entry in entries if entry.is_file())
+
+
+class Snapshot:
+    """In-memory index of the cache and target directories
+
+    The directories are listed only once, so that checking whether a file
+    exists doesn't cost a stat call per cache.ini line. If listed is False
+    nothing is kept in memory and every check is a stat call instead.
+    """
+    def __init__(self, cachedir, targetdir, subdirs, listed=True):
+        self.cachedir = cachedir
+        self.targetdir = targetdir
+        self.targetfiles = {}
+        if listed:
+            self.cachefiles = scan(cachedir)
+            for subdir in set(subdirs):
+                self.targetfiles[subdir] = scan(os.path.join(targetdir,
+                                                             subdir))
+            self.scans = 1 + len(self.targetfiles)
+        else:
+            self.cachefiles = None
+            self.scans = 0
+        # The stat calls made when a directory isn't listed
+        self.statcalls = 0
+
+    def in_cache(self, name):
+        if self.cachefiles is None:
+            self.statcalls += 1
+            return os.path.isfile(os.path.join(self.cachedir, name))
+        return name in self.cachefiles
+
+    def in_target(self, subdir, name):
+        files = self.targetfiles.get(subdir)
+        if files is None:
+            self.statcalls += 1
+            return os.path.isfile(os.path.join(self.targetdir, subdir, name))
+        return name in files
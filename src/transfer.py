@@ -0,0 +1,316 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import errno
+import os
+import re
+import shutil
+import fcntl
+import tempfile
+
+CHUNK = 16 * 1024 * 1024
+
+# The ioctl that makes a file share the data blocks of another one
+FICLONE = 0x40049409
+
+# How the files can be installed: all but move leave them in the cache too
+MODES = ('move', 'hardlink', 'reflink', 'symlink')
+
+# The temporary files of the copies: a dot, the destination name, a unique
+# suffix and .part
+PART = re.compile(r'^\.(.+)\.[0-9a-z_]+\.part$')
+
+# Errors meaning that a copy method is not available for a pair of files,
+# as long as nothing has been copied yet
+UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+               errno.ENOTSUP, errno.EBADF)
+
+
+def _copy_file_range(infd, outfd, size, throttle):
+    copied = 0
+    chunk = CHUNK if throttle is None else throttle.chunk
+    while copied < size:
+        n = os.copy_file_range(infd, outfd, min(chunk, size - copied))
+        if n == 0:
+            break
+        copied += n
+        if throttle is not None:
+            throttle.spend(size=n)
+    return copied
+
+
+def _sendfile(infd, outfd, size, throttle):
+    copied = 0
+    chunk = CHUNK if throttle is None else throttle.chunk
+    while copied < size:
+        n = os.sendfile(outfd, infd, copied, min(chunk, size - copied))
+        if n == 0:
+            break
+        copied += n
+        if throttle is not None:
+            throttle.spend(size=n)
+    return copied
+
+
+def _readwrite(infd, outfd, size, throttle):
+    copied = 0
+    chunk = CHUNK if throttle is None else throttle.chunk
+    while True:
+        buf = os.read(infd, chunk)
+        if not buf:
+            break
+        view = memoryview(buf)
+        while view:
+            n = os.write(outfd, view)
+            view = view[n:]
+        copied += len(buf)
+        if throttle is not None:
+            throttle.spend(size=len(buf))
+    return copied
+
+
+def stream(infd, outfd, size, throttle=None):
+    """Copy the content of infd to outfd, expected to be size bytes long,
+    return the method used and the bytes copied
+
+    The kernel-side methods are tried first, falling back to the next one
+    only if they fail before copying anything. Every chunk copied is charged
+    to the bytes budget of throttle, if any.
+    """
+    methods = []
+    if hasattr(os, 'copy_file_range'):
+        methods.append(('copy_file_range', _copy_file_range))
+    if hasattr(os, 'sendfile'):
+        methods.append(('sendfile', _sendfile))
+    for name, method in methods:
+        try:
+            copied = method(infd, outfd, size, throttle)
+        except OSError as e:
+            if e.errno not in UNSUPPORTED or os.lseek(outfd, 0,
+                                                      os.SEEK_END) > 0:
+                raise
+        else:
+            return name, copied
+    return 'copy', _readwrite(infd, outfd, size, throttle)
+
+
+def _part(dst):
+    # Create the temporary file of a copy to dst, return its descriptor and
+    # path: its name is unique, as concurrent copies can have the same
+    # destination, and its mode is set by copystat at the end
+    dstdir, dstname = os.path.split(dst)
+    return tempfile.mkstemp(suffix='.part', prefix='.{}.'.format(dstname),
+                            dir=dstdir)
+
+
+def parts(dstdir, dstnames):
+    """Return the temporary files left in dstdir by the interrupted copies
+    to the files named in dstnames"""
+    found = []
+    for name in os.listdir(dstdir):
+        match = PART.match(name)
+        # Older versions named them .<destination>.part
+        if ((match and match.group(1) in dstnames) or
+                (name.startswith('.') and name.endswith('.part') and
+                 name[1:-5] in dstnames)):
+            found.append(os.path.join(dstdir, name))
+    return found
+
+
+def copy(src, dst, throttle=None):
+    """Copy src to dst durably, return the method used and the size
+
+    The data is written to a temporary file in the destination directory,
+    which is synced and then renamed to dst; the copy is throttled by
+    throttle, if any. If the bytes copied are not as many as the size of
+    src, e.g. because it is still being written, EnvironmentError is raised
+    and dst is not created.
+    """
+    dstdir = os.path.dirname(dst)
+    st = os.stat(src)
+    infd = os.open(src, os.O_RDONLY)
+    tmp = None
+    try:
+        outfd, tmp = _part(dst)
+        try:
+            method, copied = stream(infd, outfd, st.st_size, throttle)
+            # The source may also have grown after the copy stopped at its
+            # initial size
+            current = os.fstat(infd).st_size
+            if copied != st.st_size or current != st.st_size:
+                raise OSError(errno.EIO, 'copied {} bytes, the file has '
+                              '{}'.format(copied, current), src)
+            os.fsync(outfd)
+        finally:
+            os.close(outfd)
+    except EnvironmentError:
+        try:
+            if tmp is not None:
+                os.remove(tmp)
+        except EnvironmentError:
+            pass
+        raise
+    finally:
+        os.close(infd)
+    shutil.copystat(src, tmp)
+    os.rename(tmp, dst)
+    fsync_dir(dstdir)
+    return method, st.st_size
+
+
+def reflink(src, dst, throttle=None):
+    """Clone src to dst, return the method used and the size
+
+    The clone shares the data blocks of src, so only the metadata is
+    written; where the filesystem doesn't support it, src is copied, with
+    throttle, if any.
+    """
+    dstdir = os.path.dirname(dst)
+    st = os.stat(src)
+    infd = os.open(src, os.O_RDONLY)
+    tmp = None
+    try:
+        outfd, tmp = _part(dst)
+        try:
+            fcntl.ioctl(outfd, FICLONE, infd)
+            os.fsync(outfd)
+        finally:
+            os.close(outfd)
+    except OSError as e:
+        try:
+            if tmp is not None:
+                os.remove(tmp)
+        except EnvironmentError:
+            pass
+        if e.errno not in UNSUPPORTED + (errno.ENOTTY, errno.EPERM):
+            raise
+        return copy(src, dst, throttle)
+    finally:
+        os.close(infd)
+    shutil.copystat(src, tmp)
+    os.rename(tmp, dst)
+    fsync_dir(dstdir)
+    return 'reflink', st.st_size
+
+
+def linked(mode, src, dst):
+    """Return whether dst has been installed from src with mode"""
+    try:
+        if mode == 'symlink':
+            return os.path.islink(dst) and os.path.samefile(src, dst)
+        srcst = os.stat(src)
+        dstst = os.lstat(dst)
+        if os.path.samestat(srcst, dstst):
+            return True
+        # A clone can't be told apart from a copy, which is also what hard
+        # links fall back to across devices: the copy keeps the size and the
+        # modification time of src
+        return (dstst.st_size == srcst.st_size and
+                dstst.st_mtime_ns == srcst.st_mtime_ns)
+    except EnvironmentError:
+        return False
+
+
+def fsync_dir(dirname):
+    fd = os.open(dirname or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Transfer:
+    """Move the cache files to the target directories
+
+    Whether a destination directory is on the same device as the source
+    directory is checked only once: files are renamed if it is, otherwise
+    they are copied inside the kernel where possible, and the source is
+    removed only after the copy has been synced to disk.
+    
+    With the other modes the files are left in the cache and hard-linked,
+    cloned or symlinked to the destination instead; hard links and clones
+    fall back to copies across devices. The copies are charged to the bytes
+    budget of throttle, if any, as they go.
+    """
+    def __init__(self, srcdir, mode='move', throttle=None):
+        self.srcdev = os.stat(srcdir).st_dev
+        self.samedev = {}
+        self.mode = mode
+        self.throttle = throttle
+
+    def same_device(self, dirname):
+        try:
+            return self.samedev[dirname]
+        except KeyError:
+            same = os.stat(dirname).st_dev == self.srcdev
+            self.samedev[dirname] = same
+            return same
+
+    def move(self, src, dst):
+        """Move src to dst, return the method used and the size"""
+        dstdir = os.path.dirname(dst)
+        if self.same_device(dstdir):
+            size = os.stat(src).st_size
+            try:
+                os.rename(src, dst)
+            except OSError as e:
+                # For example bind mounts of the same device
+                if e.errno != errno.EXDEV:
+                    raise
+                self.samedev[dstdir] = False
+            else:
+                return 'rename', size
+        method, size = copy(src, dst, self.throttle)
+        os.remove(src)
+        return method, size
+
+    def install(self, src, dst):
+        """Install src as dst with the mode of the Transfer, return the
+        method used and the size"""
+        if self.mode == 'move':
+            return self.move(src, dst)
+        if self.mode == 'symlink':
+            size = os.stat(src).st_size
+            os.symlink(os.path.abspath(src), dst)
+            return 'symlink', size
+        if self.mode == 'reflink':
+            return reflink(src, dst, self.throttle)
+        dstdir = os.path.dirname(dst)
+        if self.same_device(dstdir):
+            size = os.stat(src).st_size
+            try:
+                os.link(src, dst)
+            except OSError as e:
+                # Cross-device bind mounts, or filesystems without hard
+                # links
+                if e.errno not in (errno.EXDEV, errno.EPERM,
+                                   errno.EOPNOTSUPP):
+                    raise
+                self.samedev[dstdir] = False
+            else:
+                return 'hardlink', size
+        return copy(src, dst, self.throttle)
@@ -0,0 +1,314 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import concurrent.futures
+import fcntl
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import zlib
+
+# The maximum uncompressed size of a chunk, as written by the game's ucc
+CHUNK = 32768
+# The maximum compressed size of a chunk accepted when decompressing
+MAXPACKED = 2 * CHUNK
+# Hidden, as the redirect folder is served to the clients
+INDEX = '.utcachex.uz2.json'
+# The index of older versions, imported and removed by the first save
+OLDINDEX = 'utcachex.uz2.json'
+
+
+class UZ2Error(Exception):
+    pass
+
+
+def _part(src, dst):
+    # Open a temporary file with a unique name next to dst, with the
+    # permissions of src: concurrent runs can write the same dst
+    fd, part = tempfile.mkstemp(suffix='.part',
+                                prefix='.{}.'.format(os.path.basename(dst)),
+                                dir=os.path.dirname(dst))
+    try:
+        os.fchmod(fd, os.stat(src).st_mode & 0o777)
+    except EnvironmentError:
+        os.close(fd)
+        os.remove(part)
+        raise
+    return os.fdopen(fd, 'wb'), part
+
+
+def compress(src, dst):
+    """Compress src into the .uz2 file dst, return the size of dst
+
+    Every chunk of src is zlib-compressed and preceded by its compressed and
+    uncompressed sizes, as little-endian 32-bit integers.
+    """
+    fdst, part = _part(src, dst)
+    try:
+        with open(src, 'rb') as fsrc, fdst:
+            while True:
+                data = fsrc.read(CHUNK)
+                if not data:
+                    break
+                packed = zlib.compress(data, 9)
+                fdst.write(struct.pack('<ii', len(packed), len(data)))
+                fdst.write(packed)
+            size = fdst.tell()
+        os.replace(part, dst)
+    except EnvironmentError:
+        try:
+            os.remove(part)
+        except FileNotFoundError:
+            pass
+        raise
+    return size
+
+
+def _chunks(f):
+    # Yield the decompressed chunks of the .uz2 file f, one at a time
+    while True:
+        header = f.read(8)
+        if not header:
+            return
+        if len(header) < 8:
+            raise UZ2Error('truncated chunk header')
+        packedsize, size = struct.unpack('<ii', header)
+        if not (0 < packedsize <= MAXPACKED and 0 < size <= CHUNK):
+            raise UZ2Error('invalid chunk sizes {} and {}'.format(packedsize,
+                                                                 size))
+        packed = f.read(packedsize)
+        if len(packed) < packedsize:
+            raise UZ2Error('truncated chunk')
+        try:
+            data = zlib.decompress(packed)
+        except zlib.error as e:
+            raise UZ2Error(str(e))
+        if len(data) != size:
+            raise UZ2Error('chunk of {} bytes instead of {}'.format(len(data),
+                                                                    size))
+        yield data
+
+
+def decompress(src, dst):
+    """Decompress the .uz2 file src into dst, return the size of dst
+
+    The chunks are decompressed one at a time into a temporary file, which
+    is synced and then renamed to dst.
+    """
+    fdst, part = _part(src, dst)
+    try:
+        with open(src, 'rb') as fsrc, fdst:
+            for data in _chunks(fsrc):
+                fdst.write(data)
+            size = fdst.tell()
+            fdst.flush()
+            os.fsync(fdst.fileno())
+        os.replace(part, dst)
+    except (EnvironmentError, UZ2Error):
+        try:
+            os.remove(part)
+        except FileNotFoundError:
+            pass
+        raise
+    return size
+
+
+def digest(src):
+    """Return the SHA-1 of the decompressed content of the .uz2 file src,
+    as computed by dedup.hash_file"""
+    sha = hashlib.sha1()
+    with open(src, 'rb') as f:
+        for data in _chunks(f):
+            sha.update(data)
+    return sha.hexdigest()
+
+
+def _compress(job):
+    # Executed in the worker processes: exceptions are returned as messages
+    src, dst = job
+    try:
+        return compress(src, dst), None
+    except EnvironmentError as e:
+        return 0, e.strerror
+
+
+def _decompress(job):
+    src, dst = job
+    try:
+        return decompress(src, dst), None
+    except EnvironmentError as e:
+        return 0, e.strerror
+    except UZ2Error as e:
+        return 0, 'corrupt .uz2 file: {}'.format(e)
+
+
+def _digest(src):
+    try:
+        return digest(src), None
+    except EnvironmentError as e:
+        return None, e.strerror
+    except UZ2Error as e:
+        return None, 'corrupt .uz2 file: {}'.format(e)
+
+
+def pool_map(function, jobs, processes=0):
+    """Return the list of the results of function for jobs, computed in up
+    to processes worker processes (0 for as many as the CPUs)"""
+    if len(jobs) > 1 and processes != 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                            max_workers=processes or None) as executor:
+            return list(executor.map(function, jobs,
+                                     chunksize=max(len(jobs) // 64, 1)))
+    return [function(job) for job in jobs]
+
+
+def ingest(jobs, processes=0):
+    """Decompress the (.uz2 file, destination) pairs in jobs, return the
+    list of the (size, error message) results"""
+    return pool_map(_decompress, jobs, processes)
+
+
+def digests(files, processes=0):
+    """Return the list of the (digest, error message) of the decompressed
+    contents of the .uz2 files"""
+    return pool_map(_digest, files, processes)
+
+
+class Exporter:
+    """Keep the .uz2 files of a redirect folder up to date
+
+    A .uz2 file is compressed again only if the size or the modification
+    time of its source file have changed since the last export, as
+    remembered in the INDEX file of the redirect folder. Several exporters
+    can share the same redirect folder: save() merges their changes.
+    """
+    def __init__(self, redirectdir, processes=0):
+        self.redirectdir = redirectdir
+        self.processes = processes
+        self.filename = os.path.join(redirectdir, INDEX)
+        self.oldfilename = os.path.join(redirectdir, OLDINDEX)
+        self.index = self._load()
+        # The entries exported or failed by this exporter, None for the
+        # failed ones
+        self.changes = {}
+
+    def _load(self):
+        for filename in (self.filename, self.oldfilename):
+            try:
+                with open(filename, 'r') as f:
+                    return json.load(f)
+            except FileNotFoundError:
+                continue
+            except (EnvironmentError, ValueError):
+                break
+        return {}
+
+    def export(self, files):
+        """Compress the files whose .uz2 is missing or out of date
+
+        Return the list of the exported .uz2 files with their sizes, the
+        number of the up-to-date ones and the list of the failures, as
+        (source file, error message) pairs.
+        """
+        exported = []
+        uptodate = 0
+        failures = []
+        jobs = []
+        keys = []
+        for src in files:
+            name = os.path.basename(src) + '.uz2'
+            dst = os.path.join(self.redirectdir, name)
+            try:
+                st = os.stat(src)
+            except EnvironmentError as e:
+                failures.append((src, e.strerror))
+                continue
+            key = [st.st_size, st.st_mtime_ns]
+            if self.index.get(name) == key and os.path.isfile(dst):
+                uptodate += 1
+                continue
+            jobs.append((src, dst))
+            keys.append((name, key))
+        
+        results = pool_map(_compress, jobs, self.processes)
+        
+        for (src, dst), (name, key), (size, error) in zip(jobs, keys,
+                                                          results):
+            if error is None:
+                self.index[name] = self.changes[name] = key
+                exported.append((dst, size))
+            else:
+                self.index.pop(name, None)
+                self.changes[name] = None
+                failures.append((src, error))
+        return exported, uptodate, failures
+
+    def save(self):
+        # Apply the changes to the index as saved by the other exporters in
+        # the meantime, holding the lock until it is replaced
+        with open(self.filename + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            index = self._load()
+            for name, key in self.changes.items():
+                if key is None:
+                    index.pop(name, None)
+                else:
+                    index[name] = key
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', prefix=INDEX + '.',
+                                       dir=self.redirectdir)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(index, f)
+                os.replace(tmp, self.filename)
+            except EnvironmentError:
+                os.remove(tmp)
+                raise
+            try:
+                os.remove(self.oldfilename)
+            except FileNotFoundError:
+                pass
+        self.index = index
+        self.changes = {}
+
+
+def installed(targetdir, paths):
+    """Yield the files in the subfolders of targetdir that can be installed
+    from the cache, paths being the extension -> subfolder map"""
+    subdirs = {}
+    for ext, subdir in paths.items():
+        subdirs.setdefault(subdir, set()).add(ext)
+    for subdir in sorted(subdirs):
+        try:
+            entries = list(os.scandir(os.path.join(targetdir, subdir)))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            if (os.path.splitext(entry.name)[1] in subdirs[subdir] and
+                                                            entry.is_file()):
+                yield entry.path
@@ -0,0 +1,181 @@
+# UT2004 CacheX - Unreal Tournament 2004 cache extraction utility for Linux.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of UT2004 CacheX.
+#
+# UT2004 CacheX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# UT2004 CacheX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with UT2004 CacheX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+UT2004 CacheX - This script moves the downloaded Unreal Tournament 2004 *.uxx
+cache files from the specified Cache directory to the corresponding ut2004
+subdirectories, renaming them with their real name.
+
+@author: Dario Giovannetti <dev@dariogiovannetti.net>
+@license: GPLv3
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+
+EVENT = struct.Struct('iIII')
+
+# Don't postpone the extraction indefinitely if the changes never stop
+MAXDELAY = 30
+
+
+def _relevant(name):
+    return name == 'cache.ini' or name.endswith('.uxx')
+
+
+def _stat(dirname, name):
+    try:
+        st = os.stat(os.path.join(dirname, name))
+    except EnvironmentError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
+
+
+def _list(dirname):
+    files = {}
+    with os.scandir(dirname) as entries:
+        for entry in entries:
+            if _relevant(entry.name):
+                try:
+                    st = entry.stat()
+                except EnvironmentError:
+                    continue
+                files[entry.name] = (st.st_size, st.st_mtime_ns)
+    return files
+
+
+class _Inotify:
+    def __init__(self, dirname):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        self.dirname = dirname
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(dirname),
+                                    IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, os.strerror(errno), dirname)
+
+    def wait(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        names = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return names
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            if mask & IN_Q_OVERFLOW:
+                # Some events have been lost: consider everything changed
+                names.update(_list(self.dirname))
+            elif length:
+                name = data[offset:offset + length].rstrip(b'\0')
+                names.add(os.fsdecode(name))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Polling:
+    def __init__(self, dirname, interval):
+        self.dirname = dirname
+        self.interval = interval
+        self.files = _list(dirname)
+
+    def wait(self, timeout):
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if end is None:
+                time.sleep(self.interval)
+            else:
+                time.sleep(max(0, min(self.interval, end - time.monotonic())))
+            files = _list(self.dirname)
+            names = set(name for name in files
+                                    if self.files.get(name) != files[name])
+            self.files = files
+            if names or (end is not None and time.monotonic() >= end):
+                return names
+
+    def close(self):
+        pass
+
+
+class Watcher:
+    """Report the changes to cache.ini and to the *.uxx files in a directory
+
+    inotify is used if available, otherwise the directory is polled.
+    """
+    def __init__(self, dirname, interval=5):
+        self.dirname = dirname
+        # The files written by the tool itself, which must not trigger a new
+        # run
+        self.own = {}
+        try:
+            self.impl = _Inotify(dirname)
+        except (OSError, AttributeError):
+            self.impl = _Polling(dirname, interval)
+            self.backend = 'polling'
+        else:
+            self.backend = 'inotify'
+
+    def written(self, name):
+        """Ignore the changes to name up to its current state"""
+        self.own[name] = _stat(self.dirname, name)
+
+    def _own(self, name):
+        return (name in self.own and
+                            _stat(self.dirname, name) == self.own[name])
+
+    def changes(self, debounce):
+        """Yield the sets of changed file names
+
+        Every set is yielded only after no further changes have happened
+        for debounce seconds.
+        """
+        while True:
+            names = self.impl.wait(None)
+            deadline = time.monotonic() + MAXDELAY
+            while time.monotonic() < deadline:
+                more = self.impl.wait(debounce)
+                if not more:
+                    break
+                names |= more
+            names = set(name for name in names
+                            if _relevant(name) and not self._own(name))
+            if names:
+                yield names
+
+    def close(self):
+        self.impl.close()